@@ -1,15 +1,32 @@
 from django.contrib import admin
-from .models import Game, GameConfig, PlayerScore
+from .models import CachedReply, Game, GameConfig, PlayerScore, KalakQuestion, SpyWord
 from django.contrib.sessions.models import Session
 from django.contrib.auth.models import User
 
-admin.site.register(Game)
+@admin.register(Game)
+class GameAdmin(admin.ModelAdmin):
+    readonly_fields = ['version', 'player_count']
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the roster may have been edited here, outside add_player() / remove_player()
+        form.instance.recount()
 
 admin.site.register(GameConfig)
 
 
 admin.site.register(PlayerScore)
 
+admin.site.register(KalakQuestion)
+
+admin.site.register(SpyWord)
+
+
+@admin.register(CachedReply)
+class CachedReplyAdmin(admin.ModelAdmin):
+    list_display = ['category', 'model', 'hits', 'created_at', 'last_used_at']
+    list_filter = ['model', 'category']
+
 
 @admin.register(Session)
 class SessionAdmin(admin.ModelAdmin):
@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.core.exceptions import ImproperlyConfigured
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # late import: registers the system checks once the settings are loaded
+        from . import checks
+
+        # gunicorn does not run system checks: refuse to start instead
+        if checks.running_gunicorn():
+            errors = checks.shared_state()
+            if errors:
+                raise ImproperlyConfigured(f"{errors[0].msg} {errors[0].hint}")
@@ -0,0 +1,256 @@
+"""
+Micro-benchmarks, run with: python manage.py bench <name> [--repeat N]
+
+Every benchmark gets a throwaway test database (never the real one) and a
+write(line) callback for its report.
+"""
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.db import connection, reset_queries
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Game, KalakBluff, PlayerScore, User
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under its function name"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@contextmanager
+def scratch_database():
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(func, repeat):
+    """Call func `repeat` times: mean / p95 latency in ms and queries per call"""
+    timings = []
+    reset_queries()  # the query log is capped: start each measurement from an empty one
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'mean': statistics.mean(timings),
+        'p95': percentile(timings, 95),
+        'queries': len(queries) / repeat,
+    }
+
+
+def row(label, stats):
+    return f"{label:<34} {stats['mean']:>9.3f} ms {stats['p95']:>9.3f} ms {stats['queries']:>8.1f}"
+
+
+HEADER = f"{'':<34} {'mean':>12} {'p95':>12} {'queries':>8}"
+
+
+def make_users(prefix, count):
+    return User.objects.bulk_create([User(username=f"{prefix}{i}") for i in range(count)])
+
+
+def run_threads(work, threads):
+    """Split work (a list of callables) over `threads` threads started together; wall time in seconds"""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(chunk):
+        try:
+            barrier.wait()
+            for call in chunk:
+                call()
+        finally:
+            connection.close()
+
+    pool = [threading.Thread(target=worker, args=(work[i::threads],)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - start
+
+
+#############################################################################################
+
+@benchmark
+def membership(write, repeat=200):
+    """get_current_game: scanning players.all() vs the EXISTS resolver, at 10 / 100 / 1000 players"""
+    from .views import get_current_game
+
+    write(HEADER)
+    for size in (10, 100, 1000):
+        users = make_users(f"m{size}_", size)
+        game = Game.objects.create(admin=users[0])
+        game.players.add(*users)
+        last = users[-1]
+
+        def scan():
+            room = Game.objects.get(room_code=game.room_code)
+            return last in room.players.all()
+
+        def resolver():
+            request = SimpleNamespace(user=last, session={'room_code': game.room_code})
+            return get_current_game(request)
+
+        write(row(f"{size} players / players.all() scan", measure(scan, repeat)))
+        write(row(f"{size} players / EXISTS resolver", measure(resolver, repeat)))
+
+
+@benchmark
+def votes(write, repeat=200):
+    """Kalak votes from `repeat` players at 1 / 8 / 32 threads: throughput and lost points, old path vs scoring"""
+    from . import scoring
+
+    def legacy_vote(game, user, bluff):
+        # what VoteKalakView used to do
+        score = PlayerScore.objects.get(game=game, user=bluff.player)
+        score.points += 1
+        score.save()
+        bluff.voters.add(user)
+
+    write(f"{'':<28} {'votes/s':>10} {'lost points':>12}")
+    for threads in (1, 8, 32):
+        for label, vote in (('read-modify-write', legacy_vote), ('scoring.cast_vote', None)):
+            users = make_users(f"v{threads}{label[0]}_", repeat + 1)
+            game = Game.objects.create(admin=users[0], kalak_phase='VOTING')
+            # everyone but the bluff's author votes: the last vote ends the round and flushes the points
+            game.players.add(*users[1:])
+            game.recount()
+            PlayerScore.objects.bulk_create([PlayerScore(game=game, user=user) for user in users])
+            bluff = KalakBluff.objects.create(game=game, player=users[0], text="lie")
+
+            if vote is None:
+                work = [lambda u=u: scoring.cast_vote(game, u, bluff.id) for u in users[1:]]
+            else:
+                work = [lambda u=u: vote(game, u, bluff) for u in users[1:]]
+            elapsed = run_threads(work, threads)
+
+            points = PlayerScore.objects.filter(game=game).aggregate(total=Sum('points'))['total']
+            write(f"{threads:>2} threads / {label:<17} {repeat / elapsed:>10.0f} {repeat - points:>12}")
+
+
+@benchmark
+def rooms(write, repeat=5000):
+    """`repeat` abandoned games in 10 waves, reaped after each wave: database size stays flat"""
+    from .reaper import reap_idle_rooms, storage_bytes
+
+    users = make_users("r_", 6)
+    wave = max(1, repeat // 10)
+
+    write(f"{'wave':>4} {'games':>7} {'reaped':>7} {'rows':>8} {'before reap':>12} {'after reap':>12}")
+    for n in range(1, 11):
+        # 6 characters, the column's max_length: only SQLite would take longer ones
+        games = Game.objects.bulk_create([Game(admin=users[0], room_code=f"R{n % 10}{i:04X}") for i in range(wave)])
+        Game.players.through.objects.bulk_create([
+            Game.players.through(game=game, user=user) for game in games for user in users
+        ])
+        # a user has a single score row: they go with the wave's last game
+        PlayerScore.objects.bulk_create([PlayerScore(game=games[-1], user=user, points=3) for user in users])
+        bluffs = KalakBluff.objects.bulk_create([
+            KalakBluff(game=game, player=user, text=f"mensonge {user.id} " * 5) for game in games for user in users
+        ])
+        KalakBluff.voters.through.objects.bulk_create([
+            KalakBluff.voters.through(kalakbluff=bluff, user=users[0]) for bluff in bluffs
+        ])
+        Game.objects.update(updated_at=timezone.now() - timedelta(days=1))
+
+        size = storage_bytes()
+        result = reap_idle_rooms(ttl=3600)
+        write(f"{n:>4} {wave * n:>7} {result['rooms']:>7} {sum(result['rows'].values()):>8} "
+              f"{size / 1024:>8.0f} KiB {storage_bytes() / 1024:>8.0f} KiB")
+
+
+@benchmark
+def room_codes(write, repeat=300):
+    """CreateRoomView at 10k / 100k live rooms, and how often the old 4-character draw would collide"""
+    from django.test import Client
+    from django.urls import reverse
+
+    from .models import ROOM_CODE_ALPHABET, generate_room_code, room_code_length
+
+    admin = make_users("rc_", 1)[0]
+    client = Client()
+    client.force_login(admin)
+
+    write(HEADER + f" {'length':>7} {'4-char collisions':>18}")
+    live = 0
+    for size in (10_000, 100_000):
+        codes = set(Game.objects.values_list('room_code', flat=True))
+        fresh = []
+        while live < size:
+            code = generate_room_code(live)
+            if code not in codes:
+                codes.add(code)
+                fresh.append(Game(admin=admin, room_code=code))
+                live += 1
+        Game.objects.bulk_create(fresh, batch_size=5000)
+
+        stats = measure(lambda: client.post(reverse('create_room')), repeat)
+        live += repeat
+        # every room on 4 characters: the chance a random draw is taken, then an IntegrityError
+        legacy = size / len(ROOM_CODE_ALPHABET) ** 4
+        write(row(f"{size} rooms / CreateRoomView", stats) + f" {room_code_length(live):>7} {legacy:>18.1%}")
+
+
+@benchmark
+def bluffs(write, repeat=200):
+    """SubmitBluffView's check: SequenceMatcher vs the round's trigram index, at 1k-character inputs (near / other text)"""
+    import random
+    from difflib import SequenceMatcher
+
+    from . import bluffs
+
+    rng = random.Random(42)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyzéèà") for _ in range(rng.randint(2, 9))) for _ in range(500)]
+
+    def text(length):
+        out = ""
+        while len(out) < length:
+            out += rng.choice(words) + " "
+        return out[:length]
+
+    answer = text(1000)
+    # same text with one word in ten changed, and an unrelated one
+    near = " ".join(rng.choice(words) if rng.random() < 0.1 else word for word in answer.split())[:1000]
+    other = text(1000)
+
+    write(HEADER)
+    for label, candidate in (("near", near), ("other", other)):
+        write(row(f"1k chars / {label} / SequenceMatcher",
+                  measure(lambda: SequenceMatcher(None, candidate, answer).ratio() > 0.7, repeat)))
+        index = bluffs.RoundBluffs(answer)  # built once per room version by bluffs.for_room()
+        write(row(f"1k chars / {label} / RoundBluffs.check",
+                  measure(lambda: index.check(candidate), repeat)))
+
+    # a full round: the answer and 20 bluffs of ~1k characters each
+    round_bluffs = [text(1000) for _ in range(20)]
+    write(row("1k chars / 20 bluffs / SequenceMatcher",
+              measure(lambda: [SequenceMatcher(None, other, b).ratio() > 0.7 for b in [answer] + round_bluffs], repeat)))
+    index = bluffs.RoundBluffs(answer, round_bluffs)
+    write(row("1k chars / 20 bluffs / RoundBluffs.check",
+              measure(lambda: index.check(other), repeat)))
+    write(row("1k chars / 20 bluffs / index build",
+              measure(lambda: bluffs.RoundBluffs(answer, round_bluffs), repeat)))
+    write(row("1k chars / 20 bluffs / index + 1 bluff",
+              measure(lambda: index.bluffs.add(near), repeat)))
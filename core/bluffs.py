@@ -0,0 +1,160 @@
+"""
+Bluff validation: a bluff is turned away when it is (nearly) the real answer,
+or (nearly) a bluff another player already wrote this round.
+
+Texts are compared normalized: casefolded, accents stripped, punctuation and
+articles dropped, so "L'Éléphant !" and "elephant" are the same bluff. The
+similarity of two texts is the Dice coefficient of their character trigrams:
+linear in the length of the texts, where difflib's ratio() is quadratic-ish.
+It tells one-word answers apart ("bleu" / "bleue" 0.67, "chat" / "chien"
+0.22) as well as long texts (character bigrams saturate there: any two
+French paragraphs share most of them). The coefficient can't exceed
+2 min / (min + max) of the two trigram set sizes, so entries of a very
+different length are skipped before any set is compared.
+
+A round's answer and bluffs are indexed from the room snapshot (no query),
+and the index follows the room from one version to the next. Two players
+sending the same bluff at the same moment are told apart by claim(), an
+atomic add to a per-round set in the state backend.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+
+from .scoring import ROUND_STATE_TTL, round_key
+from .state import get_state
+
+# results of check()
+OK = 'ok'
+TOO_CLOSE = 'too_close'   # to the real answer
+DUPLICATE = 'duplicate'   # of another bluff of the round
+
+ARTICLES = frozenset({'le', 'la', 'les', 'l', 'un', 'une', 'des', 'du', 'de', 'd', 'the', 'a', 'an'})
+WORD = re.compile(r'\w+')
+ACCENT = re.compile(r'[\u0300-\u036f]')  # combining marks, once NFKD split them from their letter
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize(text):
+    words = WORD.findall(ACCENT.sub('', unicodedata.normalize('NFKD', text.casefold())))
+    # a bluff made of articles only ("la") stays itself
+    return ' '.join(word for word in words if word not in ARTICLES) or ' '.join(words)
+
+
+def trigrams(normalized):
+    padded = f" {normalized} "
+    return frozenset(zip(padded, padded[1:], padded[2:]))
+
+
+def dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def similarity(text, other):
+    """0 to 1, 1 for the same text once normalized"""
+    return dice(trigrams(normalize(text)), trigrams(normalize(other)))
+
+
+class BluffIndex:
+    """Normalized texts with their trigrams, to find the closest one to a new text"""
+
+    def __init__(self, texts=()):
+        self.entries = []
+        self.exact = {}
+        for text in texts:
+            self.add(text)
+
+    def add(self, text):
+        key = normalize(text)
+        self.exact.setdefault(key, text)
+        self.entries.append((text, trigrams(key)))
+
+    def match(self, key, grams, threshold):
+        """The indexed text at least `threshold` similar to the normalized key (the closest one), or None"""
+        if key in self.exact:
+            return self.exact[key]
+
+        size = len(grams)
+        best, best_score = None, threshold
+        for other, other_grams in self.entries:
+            # length prefilter: 2 |A & B| / (|A| + |B|) <= 2 min(|A|, |B|) / (|A| + |B|)
+            if 2 * min(size, len(other_grams)) < best_score * (size + len(other_grams)):
+                continue
+            score = dice(grams, other_grams)
+            if score >= best_score:
+                best, best_score = other, score
+        return best
+
+
+class RoundBluffs:
+    """The real answer and the bluffs of a round, indexed"""
+
+    def __init__(self, real_answer, bluffs=()):
+        self.answer = BluffIndex([real_answer])
+        self.bluffs = BluffIndex(bluffs)
+
+    def check(self, text):
+        """OK, TOO_CLOSE to the real answer, or DUPLICATE of one of the round's bluffs"""
+        key = normalize(text)
+        grams = trigrams(key)
+        if self.answer.match(key, grams, _setting('BLUFF_ANSWER_SIMILARITY', 0.65)) is not None:
+            return TOO_CLOSE
+        if self.bluffs.match(key, grams, _setting('BLUFF_DUPLICATE_SIMILARITY', 0.8)) is not None:
+            return DUPLICATE
+        return OK
+
+
+def check(text, real_answer, bluffs=()):
+    return RoundBluffs(real_answer, bluffs).check(text)
+
+
+_rounds = {}  # game id -> (version, (round, real answer), RoundBluffs, ids of the bluffs in it)
+
+
+def for_room(room):
+    """
+    The index of a room snapshot's round. Kept per room and brought up to date
+    when the version changes: a new bluff of the same round is added to it
+    rather than the whole round indexed again.
+    """
+    cached = _rounds.get(room['id'])
+    if cached is not None and cached[0] == room['version']:
+        return cached[2]
+
+    current = (room['kalak_round'], room['kalak_real_answer'])
+    ids = {b['id'] for b in room['bluffs']}
+    if cached is not None and cached[1] == current and cached[3] <= ids:
+        index = cached[2]
+        for bluff in room['bluffs']:
+            if bluff['id'] not in cached[3]:
+                index.bluffs.add(bluff['text'])
+    else:
+        if len(_rounds) >= _setting('BLUFF_INDEX_CACHE_SIZE', 500):
+            _rounds.clear()
+        index = RoundBluffs(room['kalak_real_answer'], [b['text'] for b in room['bluffs']])
+    _rounds[room['id']] = (room['version'], current, index, ids)
+    return index
+
+
+def invalidate():
+    """Forget this process's round indexes (tests)"""
+    _rounds.clear()
+
+
+def claim(game_id, round_number, text):
+    """False if the same bluff (normalized) was already claimed this round"""
+    key = round_key(game_id, round_number, 'bluffs')
+    state = get_state()
+    if not state.sadd(key, normalize(text)):
+        return False
+    state.expire(key, ROUND_STATE_TTL)
+    return True
+
+
+def release(game_id, round_number, text):
+    """Give back a claim whose bluff was not accepted after all"""
+    get_state().srem(round_key(game_id, round_number, 'bluffs'), normalize(text))
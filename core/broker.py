@@ -0,0 +1,136 @@
+"""
+Pub/sub used to push room state to connected browsers.
+
+The default broker only reaches subscribers living in the same process, which
+is all a single ASGI worker needs. Point ROOM_BROKER at RedisBroker (or
+another Broker subclass) to fan out across processes.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """One listener on one channel, consumed from the event loop that created it"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=100)
+
+    def deliver(self, message):
+        # called from any thread
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.queue.full():
+            # a slow client only needs the latest state
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """Interface every pub/sub backend implements"""
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """Must be called from a running event loop, returns a Subscription"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for subscription in targets:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # its event loop is gone
+                self.unsubscribe(subscription)
+        return len(targets)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            listeners = self._subscribers.get(subscription.channel)
+            if listeners:
+                listeners.discard(subscription)
+                if not listeners:
+                    del self._subscribers[subscription.channel]
+
+
+class RedisBroker(Broker):
+    """
+    Publishes through Redis pub/sub (ROOM_STATE_REDIS_URL). Each process listens
+    to every room on one connection and hands messages to its local subscribers.
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(getattr(settings, 'ROOM_STATE_REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.prefix = getattr(settings, 'ROOM_STATE_PREFIX', 'knidla:')
+        self.local = InProcessBroker()
+        threading.Thread(target=self._listen, name='redis-broker', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    self.local.publish(channel, json.loads(message['data']))
+            except Exception as e:
+                print(f"Broker Error: {e}")
+                time.sleep(1)
+
+    def publish(self, channel, message):
+        return self.client.publish(self.prefix + channel, json.dumps(message))
+
+    def subscribe(self, channel):
+        return self.local.subscribe(channel)
+
+    def unsubscribe(self, subscription):
+        self.local.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, 'ROOM_BROKER', 'core.broker.InProcessBroker')
+            _broker = import_string(path)()
+    return _broker
@@ -0,0 +1,55 @@
+"""
+Per-process state and several workers don't mix.
+
+InMemoryBackend and InProcessBroker live in one process: with several
+gunicorn workers each gets its own copy of every room's counters, snapshot
+and version, rooms stall (nobody ever sees everyone done) or show stale
+state. shared_state() reports that as a system check error, and since
+gunicorn does not run system checks, CoreConfig.ready() refuses to start a
+gunicorn master with it.
+"""
+import os
+import shlex
+import sys
+
+from django.conf import settings
+from django.core import checks
+
+# setting -> its per-process default
+PER_PROCESS = {
+    'ROOM_STATE_BACKEND': 'core.state.InMemoryBackend',
+    'ROOM_BROKER': 'core.broker.InProcessBroker',
+}
+
+
+def running_gunicorn():
+    return os.path.basename(sys.argv[0]) == 'gunicorn'
+
+
+def worker_count():
+    """Workers gunicorn starts: WEB_CONCURRENCY (its default), or -w / --workers on its command line"""
+    workers = int(getattr(settings, 'WEB_CONCURRENCY', 1))
+    if running_gunicorn():
+        args = shlex.split(os.environ.get('GUNICORN_CMD_ARGS', '')) + sys.argv[1:]
+        for i, arg in enumerate(args):
+            if arg in ('-w', '--workers') and i + 1 < len(args):
+                workers = int(args[i + 1])
+            elif arg.startswith('--workers='):
+                workers = int(arg.split('=', 1)[1])
+    return workers
+
+
+@checks.register()
+def shared_state(app_configs=None, **kwargs):
+    workers = worker_count()
+    if workers <= 1:
+        return []
+    return [
+        checks.Error(
+            f"{name} is {default}, kept per process, but {workers} workers will run.",
+            hint="Use ROOM_STATE_BACKEND = 'core.state.RedisBackend' and ROOM_BROKER = 'core.broker.RedisBroker' "
+                 "(see ROOM_STATE_REDIS_URL), or run a single worker.",
+            id='core.E001',
+        )
+        for name, default in PER_PROCESS.items() if getattr(settings, name, default) == default
+    ]
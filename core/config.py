@@ -0,0 +1,221 @@
+"""
+The GameConfig / KalakConfig singletons, cached per process.
+
+game_config() and kalak_config() cost no query on a warm cache: they hand out
+a read-only copy of the row with its category list parsed and its prompt
+template compiled. Each process reads the rows' updated_at stamps (one
+query for both) at most every CONFIG_CHECK_INTERVAL seconds and reloads what
+changed: the stamps are in the database, so an edit shows up on every worker
+within that delay, whatever the state backend (at once in the process that
+saved it).
+
+Whatever edits a config still loads the row itself, get_or_create(id=1).
+
+A room can override some fields (ROOM_FIELDS) for its own rounds. It keeps
+only what differs from the global config, in Game.config_overrides, and
+inherits the rest: resolve() lays the overrides over the cached global
+config, copying the row only for rooms that override something. A round
+runs with what freeze() resolved when it started (Game.round_config, part of
+the room snapshot), so editing the global config or the room's settings
+never changes a round in progress. The content pools (core/pool.py) are
+kept per pool_key() for every config in_use().
+"""
+import copy
+import json
+import time
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.signals import post_delete, post_save
+
+from .models import Game, GameConfig, KalakConfig
+
+# by game ('KALAK' / 'SPY', as in Game.current_game): the config model and the fields a room can override
+MODELS = {'KALAK': KalakConfig, 'SPY': GameConfig}
+ROOM_FIELDS = {
+    'KALAK': ('system_prompt', 'categories', 'model', 'max_rounds'),
+    'SPY': ('prompt_template', 'categories'),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class PromptTemplate:
+    """A prompt with one placeholder, split once so rendering is a join"""
+
+    def __init__(self, template, placeholder):
+        self.parts = template.split(placeholder)
+
+    def render(self, value):
+        return value.join(self.parts)
+
+
+class CachedConfig:
+    """A config row with its parsed fields computed once; shared between threads, never change it"""
+
+    def __init__(self, row, categories, template, placeholder):
+        self.row = row
+        self.category_list = tuple(categories)
+        self.prompt = PromptTemplate(template, placeholder)
+        self.key = row.fingerprint() if isinstance(row, KalakConfig) else None
+        self.pool = row.pool_key()
+
+    def __getattr__(self, name):
+        return getattr(self.row, name)
+
+    def get_category_list(self):
+        return list(self.category_list)
+
+    get_categories_list = get_category_list
+
+    def render_prompt(self, value):
+        return self.prompt.render(value)
+
+    def fingerprint(self):
+        return self.key
+
+    def pool_key(self):
+        return self.pool
+
+
+def _compile(row):
+    if isinstance(row, KalakConfig):
+        return CachedConfig(row, row.get_categories_list(), row.system_prompt, '{theme}')
+    return CachedConfig(row, row.get_category_list(), row.prompt_template, '{category}')
+
+
+_cache = {}   # model label -> (stamp, CachedConfig)
+_stamps = {}
+_checked_at = None
+
+
+def _load_stamps():
+    """model label -> updated_at of its row, in one query"""
+    first, *others = [model.objects.filter(id=1).values_list('updated_at', Value(model._meta.label))
+                      for model in MODELS.values()]
+    return {label: stamp for stamp, label in first.union(*others, all=True)}
+
+
+def _current_stamps():
+    global _stamps, _checked_at
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= _setting('CONFIG_CHECK_INTERVAL', 1):
+        _stamps = _load_stamps()
+        _checked_at = now
+    return _stamps
+
+
+def _get(model):
+    label = model._meta.label
+    stamp = _current_stamps().get(label)
+    cached = _cache.get(label)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    row, _ = model.objects.get_or_create(id=1)
+    config = _compile(row)
+    _cache[label] = (stamp, config)
+    return config
+
+
+def game_config():
+    return _get(GameConfig)
+
+
+def kalak_config():
+    return _get(KalakConfig)
+
+
+#############################################################################################
+## per-room settings
+
+_resolved = {}  # (game, overrides as JSON) -> (global config it was made from, CachedConfig)
+
+
+def resolve(kind, overrides=None):
+    """The global config of a game with a room's overrides on top (the shared global one when there are none)"""
+    base = _get(MODELS[kind])
+    overrides = {field: value for field, value in (overrides or {}).items() if field in ROOM_FIELDS[kind]}
+    if not overrides:
+        return base
+
+    key = (kind, json.dumps(overrides, sort_keys=True))
+    cached = _resolved.get(key)
+    if cached is not None and cached[0] is base:
+        return cached[1]
+
+    row = copy.copy(base.row)
+    for field, value in overrides.items():
+        setattr(row, field, value)
+    config = _compile(row)
+    if len(_resolved) >= _setting('CONFIG_RESOLVED_CACHE_SIZE', 1000):
+        _resolved.clear()
+    _resolved[key] = (base, config)
+    return config
+
+
+def _field(room, name):
+    # rooms come as Game rows or as snapshots
+    return room[name] if isinstance(room, dict) else getattr(room, name)
+
+
+def room_config(room, kind):
+    """What the room's current round runs with; its settings as they are now if no round of this game started"""
+    frozen = _field(room, 'round_config') or {}
+    if frozen.get('kind') == kind:
+        return resolve(kind, frozen['values'])
+    return resolve(kind, (_field(room, 'config_overrides') or {}).get(kind))
+
+
+def freeze(game, kind):
+    """Resolve the config of the round game is starting and keep it on the game (saved with it)"""
+    config = resolve(kind, game.config_overrides.get(kind))
+    game.round_config = {'kind': kind, 'values': {field: getattr(config, field) for field in ROOM_FIELDS[kind]}}
+    return config
+
+
+def in_use(kind):
+    """The global config of a game, then every distinct variant of it the rooms play with"""
+    configs = {}
+    for overrides in Game.objects.exclude(config_overrides={}).values_list('config_overrides', flat=True):
+        config = resolve(kind, overrides.get(kind))
+        configs.setdefault(id(config), config)
+    base = _get(MODELS[kind])
+    configs.pop(id(base), None)
+    return [base, *configs.values()]
+
+
+def set_overrides(game, kind, values):
+    """
+    Replace the room's settings for a game with values (field -> raw value), keeping only
+    what differs from the global config. Raises ValidationError for a bad value.
+    """
+    base = _get(MODELS[kind])
+    model_fields = {field: MODELS[kind]._meta.get_field(field) for field in ROOM_FIELDS[kind]}
+    overrides = {}
+    for field, value in values.items():
+        if field in model_fields:
+            value = model_fields[field].to_python(value)
+            if value != getattr(base, field):
+                overrides[field] = value
+    game.config_overrides = {**game.config_overrides, kind: overrides}
+
+
+def invalidate():
+    """Forget this process's copies and stamps (tests)"""
+    global _checked_at
+    _cache.clear()
+    _resolved.clear()
+    _checked_at = None
+
+
+def _changed(sender, **kwargs):
+    # the other workers notice the new updated_at
+    invalidate()
+
+
+for _model in (GameConfig, KalakConfig):
+    post_save.connect(_changed, sender=_model)
+    post_delete.connect(_changed, sender=_model)
@@ -0,0 +1,112 @@
+"""
+Server-sent events endpoint: GET /events/<room_code>/
+
+Plain ASGI app mounted in knidlaspy/asgi.py next to Django, so an open stream
+costs a coroutine instead of a worker thread. The first event carries the
+full room state, every later one only the keys that changed.
+"""
+import asyncio
+import json
+from importlib import import_module
+from http.cookies import SimpleCookie
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import presence
+from .broker import get_broker
+from .realtime import public_state, room_channel, state_delta
+from .roomstate import get_snapshot
+
+EVENTS_PREFIX = '/events/'
+KEEPALIVE_SECONDS = 15
+
+
+def _session_room(headers):
+    """(room code, user id) of the logged-in session, (None, None) without one"""
+    cookies = SimpleCookie()
+    for name, value in headers:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None, None
+
+    store = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user_id = store.get('_auth_user_id')
+    if not user_id:
+        return None, None
+    return store.get('room_code'), int(user_id)
+
+
+async def _respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _event(payload):
+    return {'type': 'http.response.body', 'more_body': True,
+            'body': f"data: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()}
+
+
+async def room_events(scope, receive, send):
+    room_code = scope['path'][len(EVENTS_PREFIX):].strip('/').upper()
+
+    # only members of the room (per their session) may listen to it
+    session_room, user_id = await sync_to_async(_session_room)(scope['headers'])
+    if not room_code or session_room != room_code:
+        return await _respond(send, 403, b'Not in this room')
+
+    subscription = get_broker().subscribe(room_channel(room_code))
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+
+        # an open stream is a connected player: heartbeat now and every KEEPALIVE_SECONDS
+        loop = asyncio.get_running_loop()
+        await sync_to_async(presence.touch)(room_code, user_id)
+        beat = loop.time()
+        last = await sync_to_async(lambda: public_state(get_snapshot(room_code)))()
+        await send(_event(last))
+
+        while not last.get('closed'):
+            if loop.time() - beat >= KEEPALIVE_SECONDS:
+                await sync_to_async(presence.touch)(room_code, user_id)
+                beat = loop.time()
+
+            incoming = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({incoming, disconnected}, timeout=KEEPALIVE_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                incoming.cancel()
+                break
+            if incoming not in done:
+                incoming.cancel()
+                await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                continue
+
+            state = incoming.result()
+            delta = state_delta(last, state)
+            last = state
+            if delta:
+                await send(_event(delta))
+
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        subscription.close()
+        disconnected.cancel()
+        await sync_to_async(presence.leave)(room_code, user_id)
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
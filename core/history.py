@@ -0,0 +1,118 @@
+"""
+Kalak round history.
+
+When a round reaches RESULTS, record_round() freezes it into one RoundHistory
+row: question, answer, bluffs, who voted for what and the points everyone
+earned. Rows are only ever appended. Bluffs are deleted when the next round
+starts and rooms when their last player leaves, but the history stays. The
+summary and replay pages read a whole game back with one query.
+"""
+from collections import defaultdict
+
+from django.db.models import Prefetch
+
+from .models import Game, KalakBluff, RoundHistory, User
+
+# a game is the run of rounds since the last round 1; never look further back than this
+MAX_ROUNDS_PER_GAME = 100
+
+
+def record_round(game_id, voted, scored):
+    """
+    Archive the current round of a game once its votes are flushed. voted: ids of everyone
+    who voted, scored: ids of the players whose points were written (the others left).
+    """
+    # late import: scoring calls this function
+    from .scoring import CORRECT_ANSWER_POINTS, FOOLED_PLAYER_POINTS
+
+    game = Game.objects.only('room_code', 'kalak_round', 'kalak_question', 'kalak_real_answer',
+                             'kalak_image_url').get(pk=game_id)
+    bluffs = list(KalakBluff.objects.filter(game_id=game_id).select_related('player').only(
+        'id', 'text', 'player_id', 'player__username'
+    ).prefetch_related(Prefetch('voters', queryset=User.objects.only('id'))).order_by('id'))
+    players = dict(game.players.values_list('id', 'username'))
+
+    votes, points = {}, defaultdict(int)
+    for bluff in bluffs:
+        players.setdefault(bluff.player_id, bluff.player.username)
+        for voter in bluff.voters.all():
+            votes[voter.id] = bluff.id
+            points[bluff.player_id] += FOOLED_PLAYER_POINTS
+    for user_id in voted - set(votes):
+        votes[user_id] = 0
+        points[user_id] += CORRECT_ANSWER_POINTS
+    # as in PlayerScore: nothing for those who left
+    points = {user_id: delta for user_id, delta in points.items() if user_id in scored}
+    # voters who left without writing a bluff still get a name
+    missing = set(votes) - set(players)
+    if missing:
+        players.update(User.objects.filter(id__in=missing).values_list('id', 'username'))
+
+    # JSON object keys are strings: store ids that way from the start
+    return RoundHistory.objects.create(
+        room_code=game.room_code,
+        game_id=game_id,
+        round_number=game.kalak_round,
+        question=game.kalak_question,
+        answer=game.kalak_real_answer,
+        image_url=game.kalak_image_url or '',
+        data={
+            'players': {str(k): v for k, v in players.items()},
+            'bluffs': [{'id': b.id, 'by': str(b.player_id), 'text': b.text,
+                        'voters': [str(v.id) for v in b.voters.all()]} for b in bluffs],
+            'votes': {str(k): v for k, v in votes.items()},
+            'points': {str(k): v for k, v in points.items()},
+        },
+    )
+
+
+def last_game(room_code, before=None):
+    """Rounds of the room's latest game (finished before `before`, if given), oldest first"""
+    rows = RoundHistory.objects.filter(room_code=room_code)
+    if before is not None:
+        rows = rows.filter(created_at__lt=before)
+
+    rounds = []
+    for row in rows.order_by('-created_at')[:MAX_ROUNDS_PER_GAME]:
+        rounds.append(row)
+        if row.round_number <= 1:
+            break
+    return rounds[::-1]
+
+
+def standings(rounds):
+    """Per player over a game: total points, players fooled and right answers, best first"""
+    table = {}
+    for row in rounds:
+        names = row.data['players']
+
+        def entry(user_id):
+            # older rows may not name everyone who voted or scored
+            return table.setdefault(user_id, {'username': names.get(user_id, '?'), 'points': 0, 'fooled': 0, 'found': 0})
+
+        for user_id in names:
+            entry(user_id)
+        for user_id, delta in row.data['points'].items():
+            entry(user_id)['points'] += delta
+        for user_id, choice in row.data['votes'].items():
+            if choice == 0:
+                entry(user_id)['found'] += 1
+        for bluff in row.data['bluffs']:
+            entry(bluff['by'])['fooled'] += len(bluff['voters'])
+    return sorted(table.values(), key=lambda p: (-p['points'], p['username']))
+
+
+def replay(row):
+    """A round with names instead of ids, for the replay page"""
+    names = row.data['players']
+    return {
+        'round': row,
+        'truth_voters': [names.get(uid, '?') for uid, choice in row.data['votes'].items() if choice == 0],
+        'bluffs': [{
+            'text': bluff['text'],
+            'player': names.get(bluff['by'], '?'),
+            'voters': [names.get(uid, '?') for uid in bluff['voters']],
+        } for bluff in row.data['bluffs']],
+        'points': sorted(((names.get(uid, '?'), delta) for uid, delta in row.data['points'].items()),
+                         key=lambda item: -item[1]),
+    }
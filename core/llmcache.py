@@ -0,0 +1,147 @@
+"""
+Reply cache for live model calls.
+
+When a pool runs dry the round falls back to a live call; before paying for
+one, generate() looks for a reply already produced for the same (model,
+category, rendered prompt) and serves it instead. Policies, all settings:
+  - a room never gets the same reply twice, and a reply is retired after
+    LLM_CACHE_MAX_HITS serves overall, so players don't see repeats;
+  - past LLM_CACHE_TTL a reply is stale: it is still served right away,
+    while a fresh one is generated in the background (serve-stale);
+  - at most LLM_CACHE_MAX_ENTRIES replies are kept, least recently used
+    ones are evicted first.
+
+Pool refills don't go through here: they want new content every time.
+Hit rate: stats() for this process, `manage.py llm_cache` for the table.
+"""
+import hashlib
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import ai
+from .models import CachedReply
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def cache_key(model, category, prompt):
+    return hashlib.sha256(f"{model}\x00{category}\x00{prompt}".encode()).hexdigest()
+
+
+_counts = {'hits': 0, 'stale_hits': 0, 'misses': 0}
+_counts_lock = threading.Lock()
+
+
+def _count(name):
+    with _counts_lock:
+        _counts[name] += 1
+
+
+def stats():
+    with _counts_lock:
+        counts = dict(_counts)
+    served = sum(counts.values())
+    counts['hit_rate'] = (counts['hits'] + counts['stale_hits']) / served if served else 0.0
+    return counts
+
+
+#############################################################################################
+
+def lookup(key, room=None):
+    """The freshest reply under key that room has not seen yet and is not retired"""
+    candidates = CachedReply.objects.filter(key=key, hits__lt=_setting('LLM_CACHE_MAX_HITS', 50))
+    if room is not None:
+        candidates = candidates.exclude(rooms=room)
+    return candidates.order_by('-created_at').first()
+
+
+def store(key, model, category, prompt, reply):
+    entry = CachedReply.objects.create(key=key, model=model, category=category, prompt=prompt,
+                                       reply=reply, last_used_at=timezone.now())
+    evict()
+    return entry
+
+
+def evict():
+    """Drop the least recently used replies beyond LLM_CACHE_MAX_ENTRIES"""
+    limit = _setting('LLM_CACHE_MAX_ENTRIES', 5000)
+    doomed = CachedReply.objects.order_by('-last_used_at', '-id').values_list('id', flat=True)[limit:]
+    ids = list(doomed)
+    if ids:
+        CachedReply.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def _served(entry, room):
+    CachedReply.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    if room is not None:
+        entry.rooms.add(room)
+
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def refresh(key, model, category, prompt, temperature=None, validate=None):
+    """Generate a new reply for key and keep it, if it passes validate"""
+    try:
+        reply = ai.generate(prompt, model, temperature)
+        if validate is None or validate(reply):
+            store(key, model, category, prompt, reply)
+    except Exception as e:
+        print(f"AI Error while refreshing cached '{category}': {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def refresh_later(key, model, category, prompt, temperature=None, validate=None):
+    """refresh() on a background thread, once per key at a time"""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            refresh(key, model, category, prompt, temperature, validate)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=run, name='llm-cache-refresh', daemon=True).start()
+
+
+def generate(prompt, model, category, room=None, temperature=None, validate=None):
+    """
+    Like ai.generate(), served from the cache when a usable reply exists.
+    validate(reply) decides whether a new reply is worth keeping.
+    """
+    if not _setting('LLM_CACHE_ENABLED', True):
+        return ai.generate(prompt, model, temperature)
+
+    key = cache_key(model, category, prompt)
+    entry = lookup(key, room)
+
+    if entry is not None:
+        _served(entry, room)
+        if entry.created_at < timezone.now() - timedelta(seconds=_setting('LLM_CACHE_TTL', 7 * 24 * 3600)):
+            _count('stale_hits')
+            refresh_later(key, model, category, prompt, temperature, validate)
+        else:
+            _count('hits')
+        return entry.reply
+
+    _count('misses')
+    reply = ai.generate(prompt, model, temperature)
+    if validate is None or validate(reply):
+        entry = store(key, model, category, prompt, reply)
+        if room is not None:
+            entry.rooms.add(room)
+    return reply
@@ -0,0 +1,200 @@
+"""
+End-to-end load test, run with: python manage.py loadtest [--rooms N --players M ...]
+
+Simulates N rooms of M players going through the real views with Django's
+test client: create the room, join it, then Kalak rounds (start, every
+player writes a bluff, every player votes), each POST followed by the page
+it redirects to, like a browser. While a room plays, a poller hits both
+status endpoints with the ETag it last got, the way lobby/game pages do.
+
+Rooms run on --concurrency threads inside this one process, so the numbers
+describe what one worker process with that many threads can serve. Gemini
+is replaced by ai.FakeProvider (slowed down with --ai-latency) and the whole
+run happens in a throwaway copy of the configured database: SQLite locally,
+PostgreSQL if DATABASES points there.
+"""
+import itertools
+import random
+import statistics
+import string
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from . import ai
+from .benchmarks import percentile, scratch_database
+from .models import Game, KalakConfig, Profile, User
+from .state import get_state
+
+
+def fake_reply(prompt):
+    """What FakeProvider answers in place of Gemini: a numbered Kalak question or a list of spy words"""
+    n = next(_replies)
+    return f"Question {n} ?|réponse {n}|_" if '|' in prompt else '\n'.join(f"Mot {n}-{i}" for i in range(20))
+
+
+_replies = itertools.count(1)
+
+
+def bluff_text():
+    """Three made-up words: far from every other bluff and from the real answer (see core/bluffs.py)"""
+    return ' '.join(''.join(random.choices(string.ascii_lowercase, k=6)) for _ in range(3))
+
+
+class RoundNotFinished(Exception):
+    pass
+
+
+class Recorder:
+    """Latency, query count and failures of every request, per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def call(self, name, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = func(*args, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.timings[name].append(elapsed)
+            self.queries[name] += len(queries)
+            if response.status_code >= 400:
+                self.errors[name] += 1
+        return response
+
+    def report(self, wall_time):
+        lines = [f"{'endpoint':<16} {'requests':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                 f"{'mean ms':>9} {'queries':>8} {'errors':>7}"]
+        total = 0
+        for name, timings in sorted(self.timings.items()):
+            total += len(timings)
+            lines.append(
+                f"{name:<16} {len(timings):>9} {percentile(timings, 50):>9.1f} {percentile(timings, 95):>9.1f} "
+                f"{percentile(timings, 99):>9.1f} {statistics.mean(timings):>9.1f} "
+                f"{self.queries[name] / len(timings):>8.1f} {self.errors[name]:>7}"
+            )
+        lines.append(f"\n{total} requests in {wall_time:.1f} s: {total / wall_time:.0f} req/s")
+        return lines
+
+
+#############################################################################################
+
+def make_players(room, count):
+    users = User.objects.bulk_create([User(username=f"lt{room}_{i}") for i in range(count)])
+    Profile.objects.bulk_create([
+        Profile(user=user, avatar_url=f"https://example.com/{user.username}.png") for user in users
+    ])
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    return users, clients
+
+
+def browse(recorder, client, name, data=None):
+    """POST like a form submit, then GET the page it redirects to"""
+    response = recorder.call(name, client.post, reverse(name), data or {})
+    if response.status_code == 302:
+        page = 'lobby' if response.url == reverse('lobby') else 'play' if response.url == reverse('play') else 'other'
+        recorder.call(f"GET {page}", client.get, response.url)
+    return response
+
+
+def poll(recorder, client, room_code, stop, interval):
+    """One open page: both status endpoints, with the ETag from the previous answer"""
+    etags = {}
+    urls = {'game_data_api': reverse('game_data_api', args=[room_code]), 'game_status': reverse('game_status')}
+    try:
+        while not stop.is_set():
+            for name, url in urls.items():
+                headers = {'If-None-Match': etags[name]} if name in etags else {}
+                response = recorder.call(name, client.get, url, headers=headers)
+                if response.has_header('ETag'):
+                    etags[name] = response['ETag']
+            stop.wait(interval)
+    finally:
+        connection.close()
+
+
+def play_room(recorder, room, players, rounds, poll_interval):
+    """The full flow of one room; raises RoundNotFinished if a round does not end in RESULTS"""
+    users, clients = make_players(room, players)
+    admin = clients[0]
+
+    stop = threading.Event()
+    poller = None
+    try:
+        browse(recorder, admin, 'create_room')
+        room_code = admin.session['room_code']
+        for client in clients[1:]:
+            browse(recorder, client, 'join_room', {'room_code': room_code})
+
+        watcher = Client()
+        watcher.force_login(users[-1])
+        session = watcher.session
+        session['room_code'] = room_code
+        session.save()
+        poller = threading.Thread(target=poll, args=(recorder, watcher, room_code, stop, poll_interval))
+        poller.start()
+
+        for round_number in range(rounds):
+            browse(recorder, admin, 'start_kalak')
+            for client in clients:
+                browse(recorder, client, 'submit_bluff', {'bluff_text': bluff_text()})
+
+            # the options as the page gets them: by key only
+            voting = reverse('kalak_fragment', args=['voting']) + '?format=json'
+            choices = [o['key'] for o in recorder.call('kalak_fragment', admin.get, voting).json()['options']]
+            for client in clients:
+                browse(recorder, client, 'vote_kalak', {'choice': random.choice(choices)})
+
+            # a refused bluff or vote leaves the round hanging: the figures would mean nothing
+            phase = Game.objects.get(room_code=room_code).kalak_phase
+            if phase != 'RESULTS':
+                raise RoundNotFinished(f"room {room_code}: round {round_number + 1} stopped in {phase}")
+    finally:
+        stop.set()
+        if poller is not None:
+            poller.join()
+        connection.close()
+
+
+def run(write, rooms=50, players=6, rounds=3, concurrency=8, poll_interval=0.5, ai_latency=0.0):
+    setup_test_environment()
+    gateway = ai.AIGateway(ai.FakeProvider(fake_reply, latency=ai_latency), max_in_flight=concurrency)
+    try:
+        with scratch_database(), \
+                override_settings(POOL_BACKGROUND_REFILL=False), \
+                mock.patch.object(ai, '_gateway', gateway):
+            cache.clear()
+            get_state().clear()
+            KalakConfig.objects.get_or_create(id=1, defaults={'max_rounds': rounds + 1})
+
+            write(f"{rooms} rooms x {players} players, {rounds} Kalak rounds, "
+                  f"{concurrency} rooms at a time on {connection.vendor}\n")
+            recorder = Recorder()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                # list(): re-raises the first room that failed
+                list(pool.map(lambda room: play_room(recorder, room, players, rounds, poll_interval), range(rooms)))
+            wall_time = time.perf_counter() - start
+
+            for line in recorder.report(wall_time):
+                write(line)
+            write(f"AI calls: {gateway.stats()}")
+    finally:
+        teardown_test_environment()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import BENCHMARKS, scratch_database
+
+
+class Command(BaseCommand):
+    help = "Run one of the micro-benchmarks from core/benchmarks.py against a throwaway database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs='?', help="Benchmark to run (omit to list them).")
+        parser.add_argument('--repeat', type=int, default=None, help="Calls per measurement.")
+
+    def handle(self, *args, **options):
+        name = options['name']
+        if not name:
+            for key, func in sorted(BENCHMARKS.items()):
+                self.stdout.write(f"{key:<16} {func.__doc__}")
+            return
+        if name not in BENCHMARKS:
+            raise CommandError(f"Unknown benchmark '{name}', choose from: {', '.join(sorted(BENCHMARKS))}")
+
+        kwargs = {}
+        if options['repeat']:
+            kwargs['repeat'] = options['repeat']
+
+        with scratch_database():
+            BENCHMARKS[name](self.stdout.write, **kwargs)
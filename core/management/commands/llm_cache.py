@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from core.llmcache import evict
+from core.models import CachedReply
+
+
+class Command(BaseCommand):
+    help = "Show how much the LLM reply cache is reused, per category; optionally evict or clear it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help="Trim the cache to LLM_CACHE_MAX_ENTRIES.")
+        parser.add_argument('--clear', action='store_true', help="Delete every cached reply.")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = CachedReply.objects.all().delete()
+            self.stdout.write(f"Deleted {deleted} rows.")
+            return
+        if options['evict']:
+            self.stdout.write(f"Evicted {evict()} replies.")
+
+        rows = (CachedReply.objects.values('model', 'category')
+                .annotate(replies=Count('id'), hits=Sum('hits')).order_by('-hits'))
+
+        # every reply was generated once (a miss), each hit is a call saved
+        self.stdout.write(f"{'model':<20} {'category':<30} {'replies':>8} {'hits':>8} {'hit rate':>9}")
+        total_replies = total_hits = 0
+        for row in rows:
+            total_replies += row['replies']
+            total_hits += row['hits']
+            rate = row['hits'] / (row['hits'] + row['replies'])
+            self.stdout.write(f"{row['model']:<20} {row['category'][:30]:<30} {row['replies']:>8} "
+                              f"{row['hits']:>8} {rate:>9.0%}")
+
+        served = total_hits + total_replies
+        self.stdout.write(f"\n{total_replies} replies cached, {total_hits} calls saved"
+                          f" ({total_hits / served if served else 0:.0%} hit rate)")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import loadtest
+
+
+class Command(BaseCommand):
+    help = "Simulate rooms playing Kalak end to end and report latency, throughput and queries per endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--players', type=int, default=6, help="Players per room, admin included.")
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--concurrency', type=int, default=8, help="Rooms playing at the same time.")
+        parser.add_argument('--poll-interval', type=float, default=0.5, help="Seconds between status polls.")
+        parser.add_argument('--ai-latency', type=float, default=0.0, help="Seconds the fake Gemini takes.")
+
+    def handle(self, *args, **options):
+        try:
+            loadtest.run(
+                self.stdout.write,
+                rooms=options['rooms'],
+                players=options['players'],
+                rounds=options['rounds'],
+                concurrency=options['concurrency'],
+                poll_interval=options['poll_interval'],
+                ai_latency=options['ai_latency'],
+            )
+        except loadtest.RoundNotFinished as e:
+            raise CommandError(f"{e}, no figures: they would not mean anything") from e
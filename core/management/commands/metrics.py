@@ -0,0 +1,42 @@
+import json
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _num(value, digits=0):
+    return '-' if value is None else f"{value:.{digits}f}"
+
+
+class Command(BaseCommand):
+    help = "Print what each view costs (time, queries, DB time) on a running server, from its /api/metrics/."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api/metrics/')
+        parser.add_argument('--token', default=getattr(settings, 'METRICS_TOKEN', None),
+                            help="Defaults to METRICS_TOKEN.")
+
+    def handle(self, *args, **options):
+        request = urllib.request.Request(options['url'])
+        if options['token']:
+            request.add_header('Authorization', f"Bearer {options['token']}")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                data = json.load(response)
+        except Exception as e:
+            raise CommandError(f"Could not read {options['url']}: {e}")
+
+        self.stdout.write(f"Last {data['window_seconds']}s, {data['sample_rate']:.0%} of the requests timed")
+        self.stdout.write(f"{'view':<24} {'requests':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} "
+                          f"{'queries':>7} {'q p95':>6} {'db ms':>6}")
+        for view, row in sorted(data['views'].items(), key=lambda item: -item[1]['requests']):
+            queries = row['queries']
+            self.stdout.write(
+                f"{view:<24} {row['requests']:>8} {_num(row['ms']['p50']):>7} {_num(row['ms']['p95']):>7} "
+                f"{_num(row['ms']['p99']):>7} {_num(queries['mean'], 1):>7} "
+                f"{_num(queries['p95']):>6} {_num(row['db_ms']['mean']):>6}"
+            )
+        for section, row in data['sections'].items():
+            self.stdout.write(f"{section:<24} {row['samples']:>8} {_num(row['p50']):>7} {_num(row['p95']):>7} "
+                              f"{_num(row['p99']):>7}")
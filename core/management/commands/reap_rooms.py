@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.reaper import reap_idle_rooms
+
+
+class Command(BaseCommand):
+    help = "Delete rooms nobody touched for ROOM_IDLE_TTL seconds, with everything that hangs off them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None, help="Idle seconds (defaults to ROOM_IDLE_TTL).")
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help="Rooms deleted per transaction (defaults to ROOM_REAP_CHUNK_SIZE).")
+
+    def handle(self, *args, **options):
+        result = reap_idle_rooms(ttl=options['ttl'], chunk_size=options['chunk_size'])
+
+        for label, count in sorted(result['rows'].items()):
+            self.stdout.write(f"{label:<40} {count:>8}")
+        reclaimed = "unknown" if result['bytes'] is None else f"{result['bytes'] / 1024:.0f} KiB"
+        self.stdout.write(self.style.SUCCESS(
+            f"Reaped {result['rooms']} rooms, {sum(result['rows'].values())} rows, {reclaimed} reclaimed."
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.models import KalakQuestion, SpyWord
+from core.pool import refill_kalak_pool, refill_spy_pool
+
+
+class Command(BaseCommand):
+    help = "Fill the Spy word pool and the Kalak question pool ahead of time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spy', action='store_true', help="Only warm the Spy word pool.")
+        parser.add_argument('--kalak', action='store_true', help="Only warm the Kalak question pool.")
+        parser.add_argument('--target', type=int, default=None,
+                            help="Items wanted per category (defaults to the high watermark).")
+
+    def handle(self, *args, **options):
+        both = not options['spy'] and not options['kalak']
+
+        if options['spy'] or both:
+            added = refill_spy_pool(target=options['target'])
+            stock = SpyWord.objects.filter(used_at__isnull=True).count()
+            self.stdout.write(f"Spy words: +{added} ({stock} in stock)")
+
+        if options['kalak'] or both:
+            added = refill_kalak_pool(target=options['target'])
+            stock = KalakQuestion.objects.filter(reserved_for__isnull=True, used_at__isnull=True).count()
+            self.stdout.write(f"Kalak questions: +{added} ({stock} in stock)")
+
+        self.stdout.write(self.style.SUCCESS("Pools warmed."))
@@ -0,0 +1,330 @@
+"""
+Per-endpoint cost: wall time, DB queries, DB time and time in instrumented
+sections (the model calls behind get_ai_word / get_kalak_question).
+
+MetricsMiddleware samples METRICS_SAMPLE_RATE of the requests; every request
+is counted, only sampled ones are timed. Queries are counted by an execute
+wrapper installed on every connection, against the request record held in a
+context variable, so async views are covered too. Views are labelled by URL
+name: a new route in knidlaspy/urls.py shows up on its own, and any function
+can be timed as a section with @timed('name').
+
+Recording takes no lock: each thread writes to its own histograms and the
+readers merge them. Histograms have fixed buckets, kept both since startup
+(Prometheus, /api/metrics/?format=prometheus) and per METRICS_SLICE seconds
+over the last METRICS_WINDOW seconds (JSON, /api/metrics/, read by
+`manage.py metrics`). Every worker process keeps its own.
+"""
+import contextvars
+import functools
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+SERIES = {
+    'request_seconds': TIME_BUCKETS,
+    'db_queries': QUERY_BUCKETS,
+    'db_seconds': TIME_BUCKETS,
+    'section_seconds': TIME_BUCKETS,
+}
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th value (the largest bound for the +Inf bucket)"""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds + (self.bounds[-1],), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.bounds[-1]
+
+
+class _ThreadStore:
+    """One per thread, only ever written by that thread"""
+
+    def __init__(self):
+        self.requests = {}
+        self.total = {}
+        self.slices = {}
+
+
+_stores = []
+_local = threading.local()
+
+
+def _store():
+    store = getattr(_local, 'store', None)
+    if store is None:
+        store = _local.store = _ThreadStore()
+        _stores.append(store)  # atomic, and the only shared write
+    return store
+
+
+def _observe(histograms, series, label, value):
+    hist = histograms.get((series, label))
+    if hist is None:
+        hist = histograms[(series, label)] = Histogram(SERIES[series])
+    hist.observe(value)
+
+
+def observe(series, label, value):
+    store = _store()
+    _observe(store.total, series, label, value)
+
+    slice_seconds = _setting('METRICS_SLICE', 30)
+    now = int(time.time() // slice_seconds)
+    current = store.slices.get(now)
+    if current is None:
+        oldest = now - _setting('METRICS_WINDOW', 300) // slice_seconds
+        for old in [s for s in store.slices if s <= oldest]:
+            del store.slices[old]
+        current = store.slices[now] = {}
+    _observe(current, series, label, value)
+
+
+def count_request(view):
+    requests = _store().requests
+    requests[view] = requests.get(view, 0) + 1
+
+
+#############################################################################################
+## recording
+
+class Record:
+    __slots__ = ('queries', 'db_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_record = contextvars.ContextVar('metrics_record', default=None)
+
+
+def _count_queries(execute, sql, params, many, context):
+    record = _record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.db_seconds += time.perf_counter() - start
+
+
+def instrument(conn):
+    if _count_queries not in conn.execute_wrappers:
+        conn.execute_wrappers.append(_count_queries)
+
+
+connection_created.connect(lambda sender, connection, **kwargs: instrument(connection))
+
+
+def timed(section):
+    """Decorator: time every call of the function as `section`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe('section_seconds', section, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return _setting('METRICS_ENABLED', True) and random.random() < _setting('METRICS_SAMPLE_RATE', 0.2)
+
+    def _finish(self, request, record, start):
+        view = _view_name(request)
+        count_request(view)
+        if record is not None:
+            observe('request_seconds', view, time.perf_counter() - start)
+            observe('db_queries', view, record.queries)
+            observe('db_seconds', view, record.db_seconds)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        record = Record() if self._sampled() else None
+        instrument(connection)
+        token = _record.set(record)
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            _record.reset(token)
+            self._finish(request, record, start)
+
+    async def __acall__(self, request):
+        record = Record() if self._sampled() else None
+        token = _record.set(record)
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            _record.reset(token)
+            self._finish(request, record, start)
+
+
+#############################################################################################
+## reading
+
+def _merged(pick):
+    merged = {}
+    for store in list(_stores):
+        for histograms in pick(store):
+            for key, hist in list(histograms.items()):
+                if key not in merged:
+                    merged[key] = Histogram(hist.bounds)
+                merged[key].merge(hist)
+    return merged
+
+
+def request_counts():
+    counts = {}
+    for store in list(_stores):
+        for view, n in list(store.requests.items()):
+            counts[view] = counts.get(view, 0) + n
+    return counts
+
+
+def window():
+    """Histograms of the last METRICS_WINDOW seconds"""
+    oldest = (time.time() - _setting('METRICS_WINDOW', 300)) // _setting('METRICS_SLICE', 30)
+    return _merged(lambda store: [h for s, h in list(store.slices.items()) if s > oldest])
+
+
+def totals():
+    """Histograms since the process started"""
+    return _merged(lambda store: [store.total])
+
+
+def _summary(hist, scale=1):
+    return {
+        'samples': hist.count,
+        'mean': hist.sum / hist.count * scale if hist.count else None,
+        'p50': hist.quantile(0.5) * scale if hist.count else None,
+        'p95': hist.quantile(0.95) * scale if hist.count else None,
+        'p99': hist.quantile(0.99) * scale if hist.count else None,
+    }
+
+
+def report():
+    """Per view and per section over the rolling window, as plain data"""
+    histograms = window()
+    empty = {series: Histogram(bounds) for series, bounds in SERIES.items()}
+    requests = request_counts()
+
+    views = {}
+    for view in sorted({label for series, label in histograms if series != 'section_seconds'} | set(requests)):
+        views[view] = {
+            'requests': requests.get(view, 0),
+            'ms': _summary(histograms.get(('request_seconds', view), empty['request_seconds']), 1000),
+            'queries': _summary(histograms.get(('db_queries', view), empty['db_queries'])),
+            'db_ms': _summary(histograms.get(('db_seconds', view), empty['db_seconds']), 1000),
+        }
+    sections = {label: _summary(hist, 1000) for (series, label), hist in sorted(histograms.items())
+                if series == 'section_seconds'}
+
+    return {
+        'sample_rate': _setting('METRICS_SAMPLE_RATE', 0.2),
+        'window_seconds': _setting('METRICS_WINDOW', 300),
+        'views': views,
+        'sections': sections,
+    }
+
+
+def _label(name, value):
+    return f'{name}="{value}"'
+
+
+def prometheus():
+    """Everything since startup, in the Prometheus text format"""
+    lines = [
+        '# HELP knidla_metrics_sample_rate Share of the requests that are timed.',
+        '# TYPE knidla_metrics_sample_rate gauge',
+        f"knidla_metrics_sample_rate {_setting('METRICS_SAMPLE_RATE', 0.2)}",
+        '# HELP knidla_requests_total Requests served, per view.',
+        '# TYPE knidla_requests_total counter',
+    ]
+    for view, n in sorted(request_counts().items()):
+        lines.append(f"knidla_requests_total{{{_label('view', view)}}} {n}")
+
+    histograms = totals()
+    for series in SERIES:
+        lines += [f"# TYPE knidla_{series} histogram"]
+        kind = 'section' if series == 'section_seconds' else 'view'
+        for (name, label), hist in sorted(histograms.items()):
+            if name != series:
+                continue
+            tag = _label(kind, label)
+            cumulative = 0
+            for bound, n in zip(hist.bounds + ('+Inf',), hist.counts):
+                cumulative += n
+                lines.append(f'knidla_{series}_bucket{{{tag},le="{bound}"}} {cumulative}')
+            lines.append(f"knidla_{series}_sum{{{tag}}} {hist.sum}")
+            lines.append(f"knidla_{series}_count{{{tag}}} {hist.count}")
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget everything recorded so far (tests)"""
+    for store in list(_stores):
+        store.requests.clear()
+        store.total.clear()
+        store.slices.clear()
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_game_ready_players'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KalakQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('theme', models.CharField(db_index=True, max_length=200)),
+                ('question', models.TextField()),
+                ('answer', models.CharField(max_length=200)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
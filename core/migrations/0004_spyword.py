@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_kalakquestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpyWord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=200)),
+                ('word', models.CharField(max_length=100)),
+                ('normalized', models.CharField(db_index=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('used_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'used_at'], name='core_spywor_categor_6cc7d8_idx')],
+            },
+        ),
+    ]
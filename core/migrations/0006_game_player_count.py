@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+def count_existing_rosters(apps, schema_editor):
+    Game = apps.get_model('core', 'Game')
+    for game in Game.objects.all():
+        game.player_count = game.players.count()
+        game.round_player_count = game.round_players.count()
+        game.save(update_fields=['player_count', 'round_player_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='player_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='round_player_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_rosters, migrations.RunPython.noop),
+    ]
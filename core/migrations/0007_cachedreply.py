@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_game_player_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedReply',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=64)),
+                ('model', models.CharField(max_length=100)),
+                ('category', models.CharField(max_length=200)),
+                ('prompt', models.TextField()),
+                ('reply', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('rooms', models.ManyToManyField(blank=True, related_name='+', to='core.game')),
+            ],
+        ),
+    ]
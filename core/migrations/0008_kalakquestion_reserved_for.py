@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_cachedreply'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kalakquestion',
+            name='config_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='kalakquestion',
+            name='reserved_for',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.game'),
+        ),
+    ]
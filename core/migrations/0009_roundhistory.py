@@ -0,0 +1,31 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_kalakquestion_reserved_for'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_code', models.CharField(max_length=6)),
+                ('round_number', models.IntegerField()),
+                ('question', models.TextField()),
+                ('answer', models.CharField(max_length=200)),
+                ('image_url', models.CharField(blank=True, max_length=500)),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='history', to='core.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room_code', 'created_at'], name='core_roundh_room_co_9cd128_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_roundhistory'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='game',
+            name='round_player_count',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='round_players',
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_game_round_state'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='game',
+            name='confirmed_players',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='ready_players',
+        ),
+    ]
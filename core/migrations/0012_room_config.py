@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_drop_ready_sets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='config_overrides',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='round_config',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_room_config'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='kalak_seed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:06
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def key_existing_stock(apps, schema_editor):
+    # what is in stock was generated under the current global configs (see the models' pool_key())
+    KalakConfig = apps.get_model('core', 'KalakConfig')
+    GameConfig = apps.get_model('core', 'GameConfig')
+    kalak = KalakConfig.objects.filter(id=1).first()
+    if kalak is not None:
+        key = hashlib.sha256(f"{kalak.model}\x00{kalak.system_prompt}".encode()).hexdigest()
+        apps.get_model('core', 'KalakQuestion').objects.update(pool_key=key)
+    spy = GameConfig.objects.filter(id=1).first()
+    if spy is not None:
+        key = hashlib.sha256(spy.prompt_template.encode()).hexdigest()
+        apps.get_model('core', 'SpyWord').objects.update(pool_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_kalak_seed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kalakquestion',
+            name='pool_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='spyword',
+            name='pool_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(key_existing_stock, migrations.RunPython.noop),
+    ]
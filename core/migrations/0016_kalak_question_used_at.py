@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_config_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kalakquestion',
+            name='used_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='kalakquestion',
+            index=models.Index(fields=['theme', 'used_at'], name='core_kalakq_theme_7a5aa2_idx'),
+        ),
+    ]
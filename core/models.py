@@ -1,12 +1,35 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
-import random
+from django.utils import timezone
+import hashlib
+import secrets
 import string
 
 
 
-def generate_room_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+ROOM_CODE_ALPHABET = string.ascii_uppercase + string.digits
+ROOM_CODE_MAX_LENGTH = 6
+
+
+def room_code_length(live_rooms):
+    """
+    Shortest code length that keeps the keyspace at most ROOM_CODE_MAX_OCCUPANCY full,
+    so a random draw hits a taken code with at most that probability
+    """
+    occupancy = getattr(settings, 'ROOM_CODE_MAX_OCCUPANCY', 0.01)
+    length = getattr(settings, 'ROOM_CODE_MIN_LENGTH', 4)
+    while length < ROOM_CODE_MAX_LENGTH and live_rooms >= len(ROOM_CODE_ALPHABET) ** length * occupancy:
+        length += 1
+    return length
+
+
+def generate_room_code(live_rooms=None):
+    if live_rooms is None:
+        live_rooms = Game.objects.count()
+    return ''.join(secrets.choice(ROOM_CODE_ALPHABET) for _ in range(room_code_length(live_rooms)))
 
 
 class Profile(models.Model):
@@ -24,36 +47,90 @@ class Game(models.Model):
     room_code = models.CharField(max_length=6, default=generate_room_code, unique=True)
     admin = models.ForeignKey(User,on_delete=models.CASCADE,related_name='hosted_games')
     players = models.ManyToManyField(User,related_name='joined_games',blank=True)
+    # what this room changed from the global configs, by game ('KALAK' / 'SPY'), see core/config.py
+    config_overrides = models.JSONField(default=dict, blank=True)
+    # the settings the current round runs with, resolved when it started
+    round_config = models.JSONField(default=dict, blank=True)
 
     # GLOBAL SETTINGS 
     GAME_TYPES = [('SPY', 'Spy Game'), ('KALAK', 'Kalak')]
     current_game = models.CharField(max_length=10, choices=GAME_TYPES, default='SPY')
     is_active = models.BooleanField(default=False)
+    # also moved by bump_version(): rooms idle for ROOM_IDLE_TTL are reaped, see core/reaper.py
     updated_at = models.DateTimeField(auto_now=True)
+    # bumped (never written directly) on every change, see bump_version()
+    version = models.PositiveIntegerField(default=0)
+    # denormalized roster size, kept by add_player() / remove_player()
+    player_count = models.PositiveIntegerField(default=0)
     
     # Knidla SPY GAME DATA 
     current_word = models.CharField(max_length=100, blank=True)
     spy_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='spy_games')
-    # (confirmation logic for both games)
     is_voting = models.BooleanField(default=False)
-    confirmed_players = models.ManyToManyField(User, related_name='confirmed_games', blank=True)
 
     # KALAK DATA 
     kalak_question = models.TextField(blank=True)
     kalak_real_answer = models.CharField(max_length=200, blank=True)
     kalak_round = models.IntegerField(default=0)
-    round_players = models.ManyToManyField(User, related_name='finished_step', blank=True)
     kalak_image_url = models.URLField(blank=True, null=True)
+    # drawn at each round start, orders the voting options (see snapshot.voting_options)
+    kalak_seed = models.PositiveIntegerField(default=0)
     
     # Phases: 'WRITING' (Players write lies) -> 'VOTING' (Pick answer) -> 'RESULTS' (Show points)
     kalak_phase = models.CharField(max_length=20, default='WRITING')
 
-    ready_players = models.ManyToManyField(User, related_name='ready_in_games', blank=True)
-    
-    # Add this property so the View stops crashing
-    @property
-    def ready_player_ids(self):
-        return list(self.ready_players.values_list('id', flat=True))
+    # only ever changed with UPDATE ... SET x = <expression>
+    COUNTERS = ('version', 'player_count')
+
+    def save(self, *args, **kwargs):
+        # a plain save() must not put back stale in-memory counters
+        if self.pk and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in self.COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def create_room(cls, admin):
+        """A new room with a fresh code; draws again (a few times at most) if the code was just taken"""
+        attempts = getattr(settings, 'ROOM_CODE_ATTEMPTS', 5)
+        live_rooms = cls.objects.count()
+        for attempt in range(attempts):
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(admin=admin, room_code=generate_room_code(live_rooms))
+            except IntegrityError:
+                if attempt == attempts - 1:
+                    raise
+
+    def bump_version(self):
+        """Atomically move the room to its next version (reload the game to read it)"""
+        Game.objects.filter(pk=self.pk).update(version=models.F('version') + 1, updated_at=timezone.now())
+
+    def recount(self):
+        """Recompute player_count from the roster table"""
+        Game.objects.filter(pk=self.pk).update(player_count=Coalesce(Subquery(
+            Game.players.through.objects.filter(game_id=OuterRef('pk')).order_by()
+            .values('game_id').annotate(n=Count('*')).values('n')
+        ), 0))
+
+    def add_player(self, user):
+        self.players.add(user)
+        self.recount()
+
+    def remove_player(self, user):
+        self.players.remove(user)
+        self.recount()
+        # late import: scoring imports this module
+        from . import scoring
+        # someone who left is no longer done with the current phase
+        scoring.forget_player(self.pk, self.kalak_round, user.id)
+
+    def clear_round_players(self):
+        """Start the current round from scratch: nobody done, no votes (see core/scoring.py)"""
+        # late import: scoring imports this module
+        from . import scoring
+        scoring.clear_round(self.pk, self.kalak_round)
     
 
 class GameConfig(models.Model):
@@ -77,16 +154,40 @@ class GameConfig(models.Model):
     )
 
     kalak_prompt = models.TextField(default="Donne-moi une question de culture générale obscure et sa réponse.")
+    updated_at = models.DateTimeField(auto_now=True)  # workers reload the cached config when it moves, see core/config.py
 
 
     def get_category_list(self):
         return [line.strip() for line in self.categories.split('\n') if line.strip()]
 
+    def render_prompt(self, category):
+        return self.prompt_template.replace("{category}", category)
+
+    def pool_key(self):
+        """Pooled words are only handed out under the prompt they were generated with"""
+        return hashlib.sha256(self.prompt_template.encode()).hexdigest()
+
     def __str__(self):
         return "Game Configuration"
 
         
 
+class SpyWord(models.Model):
+    """A pre-generated secret word; used rows are kept a while so batches can be deduplicated"""
+    category = models.CharField(max_length=200)
+    word = models.CharField(max_length=100)
+    normalized = models.CharField(max_length=100, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    used_at = models.DateTimeField(null=True, blank=True)
+    pool_key = models.CharField(max_length=64, blank=True)  # GameConfig.pool_key() it was generated under
+
+    class Meta:
+        indexes = [models.Index(fields=['category', 'used_at'])]
+
+    def __str__(self):
+        return f"[{self.category}] {self.word}"
+
+
 class PlayerScore(models.Model):
     """Tracks points for a specific player"""
     game = models.ForeignKey('Game', on_delete=models.CASCADE, related_name='leaderboard')
@@ -129,10 +230,78 @@ class KalakConfig(models.Model):
     model = models.CharField(max_length=100, default='gemini-2.0-flash')    
     
     max_rounds = models.IntegerField(default=20)
+    updated_at = models.DateTimeField(auto_now=True)  # workers reload the cached config when it moves, see core/config.py
 
     def get_categories_list(self):
         return [x.strip() for x in self.categories.split(',') if x.strip()]
 
+    def render_prompt(self, theme):
+        return self.system_prompt.replace("{theme}", theme)
+
+    def fingerprint(self):
+        """Changes whenever a setting that shapes the questions does"""
+        return hashlib.sha256(f"{self.model}\x00{self.categories}\x00{self.system_prompt}".encode()).hexdigest()
+
+    def pool_key(self):
+        """Pooled questions are only handed out under the prompt and model they were generated with"""
+        return hashlib.sha256(f"{self.model}\x00{self.system_prompt}".encode()).hexdigest()
+
     def __str__(self):
         return "Kalak Configuration"
-    
\ No newline at end of file
+
+
+class KalakQuestion(models.Model):
+    """A pre-generated question waiting in the pool; served rows are kept a while so batches can be deduplicated"""
+    theme = models.CharField(max_length=200, db_index=True)
+    question = models.TextField()
+    answer = models.CharField(max_length=200)
+    image_url = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # set aside as the next round of a room (see pool.prepare_kalak_round), under this config
+    reserved_for = models.ForeignKey(Game, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    config_key = models.CharField(max_length=64, blank=True)
+    pool_key = models.CharField(max_length=64, blank=True)  # KalakConfig.pool_key() it was generated under
+    used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['theme', 'used_at'])]
+
+    def __str__(self):
+        return f"[{self.theme}] {self.question}"
+
+
+class CachedReply(models.Model):
+    """A model reply kept for reuse by the live generation path, see core/llmcache.py"""
+    key = models.CharField(max_length=64, db_index=True)  # sha256 of model, category and prompt
+    model = models.CharField(max_length=100)
+    category = models.CharField(max_length=200)
+    prompt = models.TextField()
+    reply = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    hits = models.PositiveIntegerField(default=0)  # times served from the cache
+    # rooms that already got this reply: never served to them again
+    rooms = models.ManyToManyField(Game, blank=True, related_name='+')
+
+    def __str__(self):
+        return f"[{self.model} / {self.category}] {self.reply[:60]}"
+
+
+class RoundHistory(models.Model):
+    """One finished Kalak round, frozen when it reached RESULTS; append-only, see core/history.py"""
+    room_code = models.CharField(max_length=6)
+    # kept when the room itself is deleted
+    game = models.ForeignKey(Game, null=True, blank=True, on_delete=models.SET_NULL, related_name='history')
+    round_number = models.IntegerField()
+    question = models.TextField()
+    answer = models.CharField(max_length=200)
+    image_url = models.CharField(max_length=500, blank=True)
+    # {"players": {id: name}, "bluffs": [{id, by, text, voters}], "votes": {id: bluff id or 0}, "points": {id: delta}}
+    data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['room_code', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.room_code} round {self.round_number}: {self.question[:60]}"
@@ -0,0 +1,404 @@
+"""
+Pre-generated content pools.
+
+Starting a round pops an item that was generated ahead of time instead of
+waiting on Gemini inside the request. A background worker keeps every theme
+between a low and a high watermark.
+
+Items are kept per pool_key() of the config they were generated under (its
+prompt, and model for Kalak): a room overriding those only gets what was
+made for it, and the worker fills the themes of every config in use (see
+config.in_use()), rooms' overridden categories included. Stock no config
+uses any more is dropped.
+"""
+import math
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import config as site_config
+from .models import Game, KalakQuestion, SpyWord
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+#############################################################################################
+## background worker
+
+class PoolWorker(threading.Thread):
+    """Daemon thread that runs every registered refill job when woken up"""
+
+    def __init__(self, jobs, interval):
+        super().__init__(name='content-pool-worker', daemon=True)
+        self.jobs = jobs
+        self.interval = interval
+        self.wake = threading.Event()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            for job in self.jobs:
+                close_old_connections()
+                try:
+                    job()
+                except Exception as e:
+                    print(f"Pool refill error ({job.__name__}): {e}")
+            close_old_connections()
+
+
+REFILL_JOBS = []
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def refill_job(func):
+    """Register a function the background worker should run on every wake-up"""
+    REFILL_JOBS.append(func)
+    return func
+
+
+def request_refill():
+    """Wake the background worker, starting it on first use"""
+    global _worker
+
+    if not _setting('POOL_BACKGROUND_REFILL', True):
+        return
+
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = PoolWorker(REFILL_JOBS, _setting('POOL_REFILL_INTERVAL', 60))
+            _worker.start()
+    _worker.wake.set()
+
+
+def _pools(configs, themes):
+    """(config, theme) for every pool to keep filled, each pool once"""
+    pools = {}
+    for config in configs:
+        for theme in themes(config):
+            pools.setdefault((config.pool_key(), theme), (config, theme))
+    return pools.values()
+
+
+#############################################################################################
+## kalak questions
+
+def kalak_generator(theme, count, config):
+    # late import: views imports this module
+    from .views import generate_kalak_questions
+    return generate_kalak_questions(theme, count, config)
+
+
+def kalak_themes(config):
+    return config.get_categories_list() or ["General Knowledge"]
+
+
+def _pop(queryset, reserve_for=None, config_key=''):
+    """Take the oldest free question of queryset: mark it used, or set it aside for the room reserve_for"""
+    queryset = queryset.filter(reserved_for__isnull=True, used_at__isnull=True)
+    for _ in range(3):
+        item = queryset.order_by('id').first()
+        if item is None:
+            return None
+        # another worker may have popped the same row in between
+        row = KalakQuestion.objects.filter(id=item.id, reserved_for__isnull=True, used_at__isnull=True)
+        if reserve_for is not None:
+            taken = row.update(reserved_for=reserve_for, config_key=config_key)
+        else:
+            taken = row.update(used_at=timezone.now())
+        if taken:
+            return item
+    return None
+
+
+def pop_kalak_question(config=None, reserve_for=None):
+    """Take a pooled question for a random configured theme, or None if the pool is dry"""
+    if config is None:
+        config = site_config.kalak_config()
+
+    themes = kalak_themes(config)
+    theme = random.choice(themes)
+    key = config.fingerprint() if reserve_for is not None else ''
+    stock = KalakQuestion.objects.filter(pool_key=config.pool_key())
+
+    item = _pop(stock.filter(theme=theme), reserve_for, key)
+    if item is None:
+        item = _pop(stock.filter(theme__in=themes), reserve_for, key)
+
+    request_refill()
+    return item
+
+
+def next_kalak_question(config=None, room=None):
+    """(question, answer, image) for a new round in room, straight from the pool when possible"""
+    if config is None:
+        config = site_config.kalak_config()
+
+    item = None
+    if room is not None:
+        item = take_prepared_round(room, config)
+    if item is None:
+        item = pop_kalak_question(config)
+    if item is not None:
+        return item.question, item.answer, item.image_url
+
+    # cold pool (first boot, new themes): one live call, unless the reply cache has one
+    from .views import get_kalak_question
+    return get_kalak_question(room, config)
+
+
+#############################################################################################
+## next round prepared during RESULTS
+
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='round-prefetch')
+
+
+def run_in_background(func, *args):
+    def run():
+        close_old_connections()
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"Background error ({func.__name__}): {e}")
+        finally:
+            close_old_connections()
+
+    _background.submit(run)
+
+
+def prepare_kalak_round(game):
+    """Set a question aside for the room's next round, generating one if the pool is dry"""
+    config = site_config.resolve('KALAK', game.config_overrides.get('KALAK'))
+    if game.kalak_round >= config.max_rounds:
+        return None  # the next start ends the game
+
+    key = config.fingerprint()
+    prepared = KalakQuestion.objects.filter(reserved_for=game)
+    item = prepared.filter(config_key=key).first()
+    if item is not None:
+        return item
+    prepared.delete()  # made under another config
+
+    item = pop_kalak_question(config, reserve_for=game)
+    if item is not None:
+        return item
+
+    # late import: views imports this module
+    from .views import generate_kalak_question
+    theme = random.choice(kalak_themes(config))
+    q, a, img = generate_kalak_question(theme, config, room=game, cached=True)
+    return KalakQuestion.objects.create(theme=theme, question=q, answer=a, image_url=img or '',
+                                        reserved_for=game, config_key=key, pool_key=config.pool_key())
+
+
+def prefetch_kalak_round(game):
+    """Call when a room enters RESULTS: its next round is prepared while players read the scores"""
+    if _setting('KALAK_PREFETCH_NEXT_ROUND', True):
+        run_in_background(_prefetch, game.pk)
+
+
+def _prefetch(game_id):
+    game = Game.objects.filter(pk=game_id).first()
+    if game is not None:
+        prepare_kalak_round(game)
+
+
+def take_prepared_round(game, config):
+    """The question prepared for this room, or None (nothing ready, or made under an older config)"""
+    prepared = KalakQuestion.objects.filter(reserved_for=game)
+    item = prepared.order_by('id').first()
+    if item is None:
+        return None
+    if item.config_key != config.fingerprint():
+        prepared.delete()  # never played, nothing to remember
+        return None
+    prepared.update(reserved_for=None, used_at=timezone.now())
+    return item
+
+
+def recent_kalak_questions():
+    """Normalized questions still in stock, set aside, or served in the last KALAK_DEDUP_WINDOW rounds"""
+    window = _setting('KALAK_DEDUP_WINDOW', 200)
+    unused = KalakQuestion.objects.filter(used_at__isnull=True).values_list('question', flat=True)
+    used = (KalakQuestion.objects.filter(used_at__isnull=False)
+            .order_by('-used_at').values_list('question', flat=True)[:window])
+    return {normalize_word(q) for q in [*unused, *used]}
+
+
+def prune_used_kalak_questions():
+    """Forget served questions that fell out of the dedup window"""
+    window = _setting('KALAK_DEDUP_WINDOW', 200)
+    keep = (KalakQuestion.objects.filter(used_at__isnull=False)
+            .order_by('-used_at').values_list('id', flat=True)[:window])
+    return KalakQuestion.objects.filter(used_at__isnull=False).exclude(id__in=list(keep)).delete()[0]
+
+
+@refill_job
+def refill_kalak_pool(generator=None, target=None):
+    """Top up every theme below the low watermark (or below target) with batched, deduplicated questions"""
+    generator = generator or kalak_generator
+    high = target or _setting('KALAK_POOL_HIGH_WATERMARK', 10)
+    low = target or _setting('KALAK_POOL_LOW_WATERMARK', 3)
+    batch_size = _setting('KALAK_POOL_BATCH_SIZE', 10)
+
+    configs = site_config.in_use('KALAK')
+    seen = recent_kalak_questions()
+    added = 0
+
+    for config, theme in _pools(configs, kalak_themes):
+        pool_key = config.pool_key()
+        stock = KalakQuestion.objects.filter(theme=theme, pool_key=pool_key, reserved_for__isnull=True,
+                                             used_at__isnull=True).count()
+        if stock >= low:
+            continue
+
+        missing = high - stock
+        # a spare call in case the model repeats itself or writes unusable lines
+        for _ in range(math.ceil(missing / batch_size) + 1):
+            if missing <= 0:
+                break
+            try:
+                # stored as each item streams in: a call cut short still keeps what it produced
+                for q, a, img in generator(theme, min(batch_size, missing), config):
+                    key = normalize_word(q)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    KalakQuestion.objects.create(theme=theme, question=q, answer=a, image_url=img or '',
+                                                 pool_key=pool_key)
+                    missing -= 1
+                    added += 1
+                    if missing <= 0:
+                        break
+            except Exception as e:
+                print(f"AI Error while refilling '{theme}': {e}")
+                break
+
+    # made under a prompt or model nobody plays with any more
+    (KalakQuestion.objects.filter(reserved_for__isnull=True, used_at__isnull=True)
+     .exclude(pool_key__in=[config.pool_key() for config in configs]).delete())
+    prune_used_kalak_questions()
+    return added
+
+
+#############################################################################################
+## spy words
+
+def spy_generator(category, count, config):
+    # late import: views imports this module
+    from .views import generate_spy_words
+    return generate_spy_words(category, count, config)
+
+
+def spy_categories(config):
+    return config.get_category_list() or ["Tout et n'importe quoi"]
+
+
+def normalize_word(word):
+    return ' '.join(word.casefold().split())
+
+
+def pop_spy_word(config=None):
+    """Mark a pooled word of a random category as used and return it, or None if the pool is dry"""
+    if config is None:
+        config = site_config.game_config()
+
+    categories = spy_categories(config)
+    stock = SpyWord.objects.filter(pool_key=config.pool_key())
+    word = None
+
+    for queryset in (stock.filter(category=random.choice(categories)), stock.filter(category__in=categories)):
+        for _ in range(3):
+            item = queryset.filter(used_at__isnull=True).order_by('id').first()
+            if item is None:
+                break
+            # the used_at guard makes concurrent pops of the same row harmless
+            if SpyWord.objects.filter(id=item.id, used_at__isnull=True).update(used_at=timezone.now()):
+                word = item.word
+                break
+        if word is not None:
+            break
+
+    request_refill()
+    return word
+
+
+def next_spy_word(config=None, room=None):
+    word = pop_spy_word(config)
+    if word is not None:
+        return word
+
+    # cold pool: reply cache or one live call, which already falls back to BACKUP_WORDS
+    from .views import get_ai_word
+    return get_ai_word(room, config)
+
+
+def recent_spy_words():
+    """Normalized words still in stock or handed out in the last SPY_DEDUP_WINDOW rounds"""
+    window = _setting('SPY_DEDUP_WINDOW', 200)
+    unused = SpyWord.objects.filter(used_at__isnull=True).values_list('normalized', flat=True)
+    used = (SpyWord.objects.filter(used_at__isnull=False)
+            .order_by('-used_at').values_list('normalized', flat=True)[:window])
+    return set(unused) | set(used)
+
+
+def prune_used_spy_words():
+    """Forget used words that fell out of the dedup window"""
+    window = _setting('SPY_DEDUP_WINDOW', 200)
+    keep = (SpyWord.objects.filter(used_at__isnull=False)
+            .order_by('-used_at').values_list('id', flat=True)[:window])
+    return SpyWord.objects.filter(used_at__isnull=False).exclude(id__in=list(keep)).delete()[0]
+
+
+@refill_job
+def refill_spy_pool(generator=None, target=None):
+    """Top up every category below the low watermark (or below target) with batched, deduplicated words"""
+    generator = generator or spy_generator
+    high = target or _setting('SPY_POOL_HIGH_WATERMARK', 30)
+    low = target or _setting('SPY_POOL_LOW_WATERMARK', 5)
+    batch_size = _setting('SPY_POOL_BATCH_SIZE', 15)
+
+    configs = site_config.in_use('SPY')
+    seen = recent_spy_words()
+    added = 0
+
+    for config, category in _pools(configs, spy_categories):
+        pool_key = config.pool_key()
+        stock = SpyWord.objects.filter(category=category, pool_key=pool_key, used_at__isnull=True).count()
+        if stock >= low:
+            continue
+
+        missing = high - stock
+        # a couple of spare calls in case the model keeps repeating itself
+        for _ in range(math.ceil(missing / batch_size) + 2):
+            if missing <= 0:
+                break
+            try:
+                words = generator(category, min(batch_size, missing), config)
+            except Exception as e:
+                print(f"AI Error while refilling '{category}': {e}")
+                break
+
+            fresh = []
+            for word in words:
+                key = normalize_word(word)
+                if key and key not in seen and len(fresh) < missing:
+                    seen.add(key)
+                    fresh.append(SpyWord(category=category, word=word[:100], normalized=key[:100],
+                                         pool_key=pool_key))
+
+            SpyWord.objects.bulk_create(fresh)
+            missing -= len(fresh)
+            added += len(fresh)
+
+    SpyWord.objects.filter(used_at__isnull=True).exclude(pool_key__in=[config.pool_key() for config in configs]).delete()
+    prune_used_spy_words()
+    return added
@@ -0,0 +1,100 @@
+"""
+Who is in a room right now, and who is ready.
+
+Lives in the state backend next to the round counters, never in the
+database:
+  - `seen`: a hash of user id -> last heartbeat (unix seconds). Open event
+    streams and status polls call touch(); a player whose last heartbeat
+    is older than PRESENCE_TIMEOUT is offline and dropped on the next read.
+    Closing the event stream drops them right away;
+  - `ready`: the players who said they are ready for the next round,
+    forgotten when a round starts.
+Who already acted in the current phase is the round's `done` set, see
+core/scoring.py.
+
+A change (someone connects, drops or toggles ready) is pushed to the room's
+subscribers with the rest of the public state; nothing is written until the
+next round boundary, where the game row is saved anyway.
+"""
+import time
+
+from django.conf import settings
+
+from .state import get_state
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def seen_key(room_code):
+    return f"room:{room_code}:seen"
+
+
+def ready_key(room_code):
+    return f"room:{room_code}:ready"
+
+
+def _prune(room_code, now):
+    """Online ids, after dropping everyone whose heartbeat is too old"""
+    state = get_state()
+    timeout = _setting('PRESENCE_TIMEOUT', 45)
+    online = set()
+    for user_id, at in state.hgetall(seen_key(room_code)).items():
+        if now - at > timeout:
+            state.hdel(seen_key(room_code), user_id)
+        else:
+            online.add(int(user_id))
+    return online
+
+
+def online_ids(room_code):
+    return sorted(_prune(room_code, int(time.time())))
+
+
+def ready_ids(room_code):
+    return sorted(int(member) for member in get_state().smembers(ready_key(room_code)))
+
+
+def touch(room_code, user_id):
+    """Heartbeat; announces the room when the player just came (back) online"""
+    now = int(time.time())
+    before = _prune(room_code, now)
+    state = get_state()
+    state.hset(seen_key(room_code), str(user_id), now)
+    state.expire(seen_key(room_code), _setting('PRESENCE_TIMEOUT', 45) * 2)
+    if user_id not in before:
+        announce(room_code)
+
+
+def leave(room_code, user_id):
+    get_state().hdel(seen_key(room_code), str(user_id))
+    announce(room_code)
+
+
+def set_ready(room_code, user_id, ready):
+    state = get_state()
+    if ready:
+        state.sadd(ready_key(room_code), str(user_id))
+        state.expire(ready_key(room_code), _setting('ROOM_SNAPSHOT_TTL', 3600))
+    else:
+        state.srem(ready_key(room_code), str(user_id))
+    announce(room_code)
+
+
+def clear_ready(room_code):
+    get_state().delete(ready_key(room_code))
+
+
+def forget(room_code):
+    get_state().delete(seen_key(room_code), ready_key(room_code))
+
+
+def announce(room_code):
+    # late import: roomstate imports realtime, which imports this module
+    from .realtime import broadcast
+    from .roomstate import get_snapshot
+
+    snapshot = get_snapshot(room_code)
+    if snapshot is not None:
+        broadcast(snapshot)
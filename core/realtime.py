@@ -0,0 +1,51 @@
+"""
+Compact room state pushed to every browser sitting in a room.
+
+It is a public projection of the room snapshot (see roomstate): each open
+event stream forwards only the keys that changed since it last wrote to its
+client. Nothing private (the secret word, the spy, the real answer, who wrote
+which bluff) goes in here.
+"""
+from . import presence
+from .broker import get_broker
+
+
+def room_channel(room_code):
+    return f"room:{room_code}"
+
+
+def public_state(snapshot):
+    if snapshot is None:
+        return {'closed': True}
+
+    return {
+        'v': snapshot['version'],
+        'game': snapshot['current_game'],
+        'active': snapshot['is_active'],
+        'phase': snapshot['kalak_phase'],
+        'round': snapshot['kalak_round'],
+        'admin': snapshot['admin_id'],
+        'players': [[p['id'], p['username'], p['avatar'], p['points']] for p in snapshot['players']],
+        'ready': snapshot['round_player_ids'],
+        'online': presence.online_ids(snapshot['room_code']),
+        'lobby_ready': presence.ready_ids(snapshot['room_code']),
+    }
+
+
+def broadcast(snapshot):
+    try:
+        get_broker().publish(room_channel(snapshot['room_code']), public_state(snapshot))
+    except Exception as e:
+        # live updates are best effort, never fail the action that triggered them
+        print(f"Publish Error: {e}")
+
+
+def broadcast_closed(room_code):
+    get_broker().publish(room_channel(room_code), {'closed': True})
+
+
+def state_delta(previous, current):
+    """Keys of current that differ from previous (everything when there is no previous)"""
+    if not previous:
+        return dict(current)
+    return {key: value for key, value in current.items() if previous.get(key) != value}
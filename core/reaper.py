@@ -0,0 +1,127 @@
+"""
+Idle room reaper.
+
+Rooms are deleted when their last player leaves, but a room everybody just
+closed the tab on stays forever, with its rosters, bluffs, scores and
+prepared question. reap_idle_rooms() deletes every room untouched (no
+published change, see Game.bump_version) for ROOM_IDLE_TTL seconds and with
+nobody connected (see core/presence.py), in chunks of ROOM_REAP_CHUNK_SIZE
+rooms per transaction so a big backlog never holds a long write lock. Round history is kept (its game link is cleared).
+
+Run it with `manage.py reap_rooms`, or set ROOM_REAP_INTERVAL to have a
+daemon thread do it every that many seconds (started with the first room
+created by this process).
+"""
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import presence
+from .models import Game
+from .roomstate import publish_closed
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def storage_bytes():
+    """Bytes the database actually uses, None where we can't tell"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # freed pages stay in the file until VACUUM, but are reused first
+            cursor.execute("PRAGMA page_count")
+            pages = cursor.fetchone()[0]
+            cursor.execute("PRAGMA freelist_count")
+            pages -= cursor.fetchone()[0]
+            cursor.execute("PRAGMA page_size")
+            return pages * cursor.fetchone()[0]
+        if connection.vendor == 'postgresql':
+            # dead rows count until autovacuum gets to them
+            cursor.execute("SELECT pg_database_size(current_database())")
+            return cursor.fetchone()[0]
+    return None
+
+
+def reap_idle_rooms(ttl=None, chunk_size=None, now=None):
+    """
+    Delete rooms idle for more than ttl seconds.
+    Returns {'rooms': n, 'rows': {model label: n}, 'bytes': reclaimed or None}.
+    """
+    ttl = _setting('ROOM_IDLE_TTL', 6 * 3600) if ttl is None else ttl
+    chunk_size = chunk_size or _setting('ROOM_REAP_CHUNK_SIZE', 200)
+    cutoff = (now or timezone.now()) - timedelta(seconds=ttl)
+
+    before = storage_bytes()
+    rows = Counter()
+    rooms = 0
+    last_id = 0
+    while True:
+        chunk = list(Game.objects.filter(updated_at__lt=cutoff, id__gt=last_id)
+                     .order_by('id').values_list('id', 'room_code')[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        # players still connected keep a quiet room (a long lobby wait) alive
+        ids = [pk for pk, code in chunk if not presence.online_ids(code)]
+
+        with transaction.atomic():
+            # checked again inside the transaction: a room may have woken up since
+            idle = Game.objects.filter(id__in=ids, updated_at__lt=cutoff)
+            codes = list(idle.values_list('room_code', flat=True))
+            _, deleted = idle.delete()
+        rows.update(deleted)
+        rooms += len(codes)
+        for code in codes:
+            publish_closed(code)
+
+    after = storage_bytes()
+    return {
+        'rooms': rooms,
+        'rows': dict(rows),
+        'bytes': before - after if before is not None and after is not None else None,
+    }
+
+
+#############################################################################################
+## in-process schedule
+
+class Reaper(threading.Thread):
+
+    def __init__(self, interval):
+        super().__init__(name='room-reaper', daemon=True)
+        self.interval = interval
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            close_old_connections()
+            try:
+                result = reap_idle_rooms()
+                if result['rooms']:
+                    print(f"Reaped {result['rooms']} idle rooms ({sum(result['rows'].values())} rows)")
+            except Exception as e:
+                print(f"Room reaper error: {e}")
+            close_old_connections()
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def start_reaper():
+    """Start the periodic reaper if ROOM_REAP_INTERVAL is set; no-op if it already runs"""
+    global _reaper
+
+    interval = _setting('ROOM_REAP_INTERVAL', None)
+    if not interval:
+        return
+
+    with _reaper_lock:
+        if _reaper is None or not _reaper.is_alive():
+            _reaper = Reaper(interval)
+            _reaper.start()
@@ -0,0 +1,190 @@
+"""
+Room state cache.
+
+Each room has an integer version, bumped by publish_room() after every change,
+and a serialized snapshot of everything the pages and APIs need to read
+(game fields, players with points, per-phase player sets, bluffs). Both live
+in the state backend (core/state.py): read paths render from the snapshot and
+only go back to the database when the version moved or an idle room expired.
+
+A version stays stored as long as the snapshot (each publish overwrites it),
+so polls of a quiet room never reach the database. With several workers on
+the in-memory backend, set ROOM_VERSION_TTL to a few seconds: a worker then
+notices another one's change within that delay. RedisBackend makes it
+immediate.
+
+Status polls use the version for ETags: a poll that already has the current
+version is answered with a 304 without touching the database, and ?wait=N
+holds it until the version moves.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotModified, JsonResponse
+
+from . import presence
+from .broker import get_broker
+from .models import Game
+from .realtime import broadcast, broadcast_closed, room_channel
+from .snapshot import load_snapshot
+from .state import get_state
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def version_key(room_code):
+    return f"room:{room_code}:version"
+
+
+def snapshot_key(room_code):
+    return f"room:{room_code}:snapshot"
+
+
+#############################################################################################
+## snapshots
+
+def store_snapshot(snapshot):
+    get_state().set(snapshot_key(snapshot['room_code']), snapshot, _setting('ROOM_SNAPSHOT_TTL', 3600))
+    remember_version(snapshot['room_code'], snapshot['version'])
+    return snapshot
+
+
+def get_snapshot(room_code):
+    """Snapshot of a room at its current version, or None if the room does not exist"""
+    version = room_version(room_code)
+    if version is None:
+        get_state().delete(snapshot_key(room_code))
+        return None
+
+    snapshot = get_state().get(snapshot_key(room_code))
+    if snapshot is None or snapshot['version'] < version:
+        snapshot = load_snapshot(room_code=room_code)
+        if snapshot is None:
+            return None
+        store_snapshot(snapshot)
+    return snapshot
+
+
+def publish_room(game):
+    """Call after every change to a game: new version, fresh snapshot, push to subscribers"""
+    game.bump_version()
+    snapshot = load_snapshot(pk=game.pk)
+    game.version = snapshot['version']
+    store_snapshot(snapshot)
+    broadcast(snapshot)
+    return snapshot
+
+
+def publish_closed(room_code):
+    get_state().delete(version_key(room_code), snapshot_key(room_code))
+    presence.forget(room_code)
+    broadcast_closed(room_code)
+
+
+#############################################################################################
+## versions
+
+def _version_ttl():
+    # ROOM_VERSION_TTL only bounds how stale another worker's change can look with per-process state
+    return _setting('ROOM_VERSION_TTL', None) or _setting('ROOM_SNAPSHOT_TTL', 3600)
+
+
+def remember_version(room_code, version):
+    current = get_state().get(version_key(room_code))
+    # concurrent publishes can finish out of order: never move backwards
+    if current is None or current <= version:
+        get_state().set(version_key(room_code), version, _version_ttl())
+
+
+def room_version(room_code):
+    """Current version of a room, from the cache when possible; None if the room does not exist"""
+    version = get_state().get(version_key(room_code))
+    if version is not None:
+        return version
+
+    version = Game.objects.filter(room_code=room_code).values_list('version', flat=True).first()
+    if version is not None:
+        get_state().set(version_key(room_code), version, _version_ttl())
+    return version
+
+
+#############################################################################################
+## conditional / long-poll responses
+
+def etag(version):
+    return f'"{version}"'
+
+
+def requested_version(request):
+    """The version the client already has, taken from If-None-Match"""
+    value = request.headers.get('If-None-Match', '')
+    if value.startswith('W/'):
+        value = value[2:]
+    return value.strip('"') or None
+
+
+def requested_wait(request):
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, _setting('LONG_POLL_MAX_WAIT', 25)))
+
+
+def _same(version, known):
+    return version is not None and str(version) == known
+
+
+async def wait_for_version_change(room_code, known, timeout):
+    """Block (asynchronously) until the room leaves version `known` or timeout expires"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    subscription = get_broker().subscribe(room_channel(room_code))
+
+    try:
+        while True:
+            version = await sync_to_async(room_version)(room_code)
+            if not _same(version, known):
+                return version
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return version
+            try:
+                # woken instantly by changes published in this process; the
+                # periodic re-check catches changes made by other workers
+                await asyncio.wait_for(subscription.get(), min(remaining, 1))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        subscription.close()
+
+
+async def conditional_room_response(request, room_code, build_payload):
+    """
+    304 when the client is up to date (after waiting up to ?wait=N seconds),
+    otherwise build_payload() -> (payload, version) as JSON with its ETag.
+    """
+    known = requested_version(request)
+    version = await sync_to_async(room_version)(room_code)
+
+    if _same(version, known):
+        wait = requested_wait(request)
+        if wait:
+            version = await wait_for_version_change(room_code, known, wait)
+
+    if _same(version, known):
+        response = HttpResponseNotModified()
+    else:
+        result = await sync_to_async(build_payload)()
+        if result is None:
+            return JsonResponse({'error': 'Room not found'}, status=404)
+        payload, version = result
+        response = JsonResponse(payload)
+
+    response['ETag'] = etag(version)
+    response['Cache-Control'] = 'no-cache'
+    return response
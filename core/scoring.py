@@ -0,0 +1,230 @@
+"""
+Kalak scoring engine: bluff submissions and votes.
+
+A round's hot counters live in the state backend (core/state.py), not in
+the database, and every step on them is a single atomic operation:
+  - a player takes their turn for the phase by adding themselves to the
+    phase's `claimed` set, which lets them through exactly once however
+    often they click;
+  - a vote is kept in the round's `votes` hash and its points are added to
+    the `points` hash with HINCRBY, never read, bumped and written back;
+  - once the turn is taken care of, the player joins the phase's `done`
+    set; the submission that brings it up to the room size advances the
+    phase with one conditional UPDATE (still in the expected phase and
+    round, and no more players than are done), so exactly one submission
+    moves it, however many finish together.
+
+Reaching RESULTS flushes the round in the same transaction: votes become
+bluff voters, points are added to the PlayerScore of the players still in
+the game (the points of anyone who left are dropped), the round is archived.
+A round costs the database its bluffs and a few statements per phase change,
+whatever the number of players.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import history
+from .models import Game, KalakBluff, PlayerScore
+from .state import get_state
+
+# results of submit_bluff() / cast_vote()
+ACCEPTED = 'accepted'
+ADVANCED = 'advanced'        # accepted, and it was the last one: the phase moved on
+ALREADY_DONE = 'already_done'
+WRONG_PHASE = 'wrong_phase'
+INVALID = 'invalid'
+
+CORRECT_ANSWER_POINTS = 2
+FOOLED_PLAYER_POINTS = 1
+
+# backend keys of a round live this long at most, in case a room is abandoned mid-round
+ROUND_STATE_TTL = 24 * 3600
+# and this long once the round is flushed: clicks already past the phase check are still turned away
+FLUSHED_ROUND_TTL = 60
+
+
+def round_key(game_id, round_number, name):
+    return f"game:{game_id}:round:{round_number}:{name}"
+
+
+def phase_key(game_id, round_number, phase, name):
+    return round_key(game_id, round_number, f"{phase}:{name}")
+
+
+def round_keys(game_id, round_number):
+    return [round_key(game_id, round_number, name) for name in ('votes', 'points', 'bluffs')] + [
+        phase_key(game_id, round_number, phase, name) for phase in NEXT_PHASE for name in ('claimed', 'done')
+    ]
+
+
+def done_player_ids(game_id, round_number, phase):
+    """Players done with the phase, sorted"""
+    return sorted(int(member) for member in get_state().smembers(phase_key(game_id, round_number, phase, 'done')))
+
+
+def forget_player(game_id, round_number, user_id):
+    """Someone left: they no longer count as done (what they already scored stays)"""
+    for phase in NEXT_PHASE:
+        get_state().srem(phase_key(game_id, round_number, phase, 'done'), str(user_id))
+
+
+def clear_round(game_id, round_number):
+    get_state().delete(*round_keys(game_id, round_number))
+
+
+def expire_round(game_id, round_number, ttl):
+    state = get_state()
+    for key in round_keys(game_id, round_number):
+        state.expire(key, ttl)
+
+
+#############################################################################################
+
+def _current(game_id):
+    return Game.objects.filter(pk=game_id).values('kalak_phase', 'kalak_round', 'player_count').first()
+
+
+def _take_turn(game_id, round_number, phase, user_id):
+    """False if the player already went through this phase"""
+    key = phase_key(game_id, round_number, phase, 'claimed')
+    state = get_state()
+    if not state.sadd(key, str(user_id)):
+        return False
+    state.expire(key, ROUND_STATE_TTL)
+    return True
+
+
+def _done(game_id, round_number, phase, user_id):
+    """Count the player as done; how many are"""
+    key = phase_key(game_id, round_number, phase, 'done')
+    state = get_state()
+    state.sadd(key, str(user_id))
+    state.expire(key, ROUND_STATE_TTL)
+    return state.scard(key)
+
+
+def add_points(game_id, round_number, user_id, points):
+    key = round_key(game_id, round_number, 'points')
+    get_state().hincrby(key, str(user_id), points)
+    get_state().expire(key, ROUND_STATE_TTL)
+
+
+def flush_round(game_id, round_number):
+    """Write the round's votes and points to the database (inside the transaction that ended it)"""
+    state = get_state()
+    votes = {int(user): choice for user, choice in state.hgetall(round_key(game_id, round_number, 'votes')).items()}
+    points = {int(user): delta for user, delta in state.hgetall(round_key(game_id, round_number, 'points')).items()}
+
+    KalakBluff.voters.through.objects.bulk_create([
+        KalakBluff.voters.through(kalakbluff_id=choice, user_id=user) for user, choice in votes.items() if choice
+    ], ignore_conflicts=True)
+
+    scored = set()
+    if points:
+        # only players still in the game have a score here: someone who left may be scoring in another room
+        scores = PlayerScore.objects.filter(game_id=game_id, user_id__in=points)
+        scored = set(scores.values_list('user_id', flat=True))
+        scores.update(points=F('points') + Case(
+            *[When(user_id=user, then=Value(delta)) for user, delta in points.items()],
+            default=Value(0), output_field=IntegerField(),
+        ))
+
+    history.record_round(game_id, set(votes), scored)
+
+
+def _advance(game_id, round_number, from_phase, to_phase, **conditions):
+    """Move the game to to_phase if it is still in from_phase of the round; True for the one caller that did"""
+    advanced = (Game.objects
+                .filter(pk=game_id, kalak_phase=from_phase, kalak_round=round_number, **conditions)
+                .update(kalak_phase=to_phase, updated_at=timezone.now()))
+    if advanced and to_phase == 'RESULTS':
+        flush_round(game_id, round_number)
+        transaction.on_commit(lambda: expire_round(game_id, round_number, FLUSHED_ROUND_TTL))
+    return bool(advanced)
+
+
+def advance_when_everyone_is_done(game_id, round_number, from_phase, to_phase, done):
+    """Move the game to to_phase if `done` players cover the room; True for the one caller that did"""
+    return _advance(game_id, round_number, from_phase, to_phase, player_count__lte=done)
+
+
+NEXT_PHASE = {'WRITING': 'VOTING', 'VOTING': 'RESULTS'}
+
+
+def advance_if_complete(game):
+    """After someone left: the players still in the room may all be done already. The new phase, if it moved"""
+    current = _current(game.pk)
+    if current is None or current['kalak_phase'] not in NEXT_PHASE:
+        return None
+
+    phase, round_number = current['kalak_phase'], current['kalak_round']
+    done = get_state().scard(phase_key(game.pk, round_number, phase, 'done'))
+    with transaction.atomic():
+        if advance_when_everyone_is_done(game.pk, round_number, phase, NEXT_PHASE[phase], done):
+            return NEXT_PHASE[phase]
+    return None
+
+
+def force_advance(game):
+    """The admin moves the phase on without waiting for everyone. The new phase, if it moved"""
+    current = _current(game.pk)
+    if current is None or current['kalak_phase'] not in NEXT_PHASE:
+        return None
+
+    phase, round_number = current['kalak_phase'], current['kalak_round']
+    with transaction.atomic():
+        if _advance(game.pk, round_number, phase, NEXT_PHASE[phase]):
+            return NEXT_PHASE[phase]
+    return None
+
+
+#############################################################################################
+
+def submit_bluff(game, user, text):
+    current = _current(game.pk)
+    if current is None or current['kalak_phase'] != 'WRITING':
+        return WRONG_PHASE
+    round_number = current['kalak_round']
+    if not _take_turn(game.pk, round_number, 'WRITING', user.id):
+        return ALREADY_DONE
+
+    KalakBluff.objects.create(game_id=game.pk, player=user, text=text)
+
+    done = _done(game.pk, round_number, 'WRITING', user.id)
+    with transaction.atomic():
+        if advance_when_everyone_is_done(game.pk, round_number, 'WRITING', NEXT_PHASE['WRITING'], done):
+            return ADVANCED
+    return ACCEPTED
+
+
+def cast_vote(game, user, choice_id):
+    """choice_id 0 is the real answer, anything else a bluff of this game"""
+    current = _current(game.pk)
+    if current is None or current['kalak_phase'] != 'VOTING':
+        return WRONG_PHASE
+    round_number = current['kalak_round']
+
+    author_id = None
+    if choice_id:
+        author_id = KalakBluff.objects.filter(pk=choice_id, game_id=game.pk).values_list('player_id', flat=True).first()
+        if author_id is None:
+            return INVALID
+
+    if not _take_turn(game.pk, round_number, 'VOTING', user.id):
+        return ALREADY_DONE
+
+    votes = round_key(game.pk, round_number, 'votes')
+    get_state().hset(votes, str(user.id), int(choice_id or 0))
+    get_state().expire(votes, ROUND_STATE_TTL)
+    if author_id is None:
+        add_points(game.pk, round_number, user.id, CORRECT_ANSWER_POINTS)
+    else:
+        # author of the bluff gets points
+        add_points(game.pk, round_number, author_id, FOOLED_PLAYER_POINTS)
+
+    done = _done(game.pk, round_number, 'VOTING', user.id)
+    with transaction.atomic():
+        if advance_when_everyone_is_done(game.pk, round_number, 'VOTING', NEXT_PHASE['VOTING'], done):
+            return ADVANCED
+    return ACCEPTED
@@ -0,0 +1,111 @@
+"""
+Room snapshot builder.
+
+Loads a game with everything the pages and APIs show (players with their
+points and avatars, per-phase player sets, bluffs with their voters) in a
+fixed number of queries, however many players or bluffs the room has, and
+turns it into plain data that can be cached. Who is done with the current
+phase comes from the round's state, see core/scoring.py.
+"""
+import random
+
+from django.db.models import Prefetch
+from django.utils.crypto import salted_hmac
+
+from . import scoring
+from .models import Game, KalakBluff, PlayerScore, User
+
+
+def snapshot_queryset():
+    """Games with every relation the snapshot needs prefetched: 5 queries per room, whatever its size"""
+    players = User.objects.select_related('profile').only('id', 'username', 'profile__avatar_url').order_by('id')
+    bluffs = (KalakBluff.objects.select_related('player__profile')
+              .prefetch_related(Prefetch('voters', queryset=User.objects.only('id', 'username')))
+              .order_by('id'))
+
+    return Game.objects.prefetch_related(
+        Prefetch('players', queryset=players),
+        Prefetch('leaderboard', queryset=PlayerScore.objects.only('game_id', 'user_id', 'points')),
+        Prefetch('kalakbluff_set', queryset=bluffs),
+    )
+
+
+def _avatar(user):
+    profile = getattr(user, 'profile', None)
+    return profile.avatar_url if profile else None
+
+
+def option_key(game_id, seed, choice_id):
+    """What the page calls an option: opaque, and new every round, so the real answer looks like any bluff"""
+    return salted_hmac('kalak-option', f"{game_id}:{seed}:{choice_id}").hexdigest()[:16]
+
+
+def voting_options(game_id, seed, bluffs, real_answer):
+    """
+    The options of a vote, shuffled by the round's seed: the same order for every player and
+    every reload. The seed is drawn when the round starts and never leaves the server, nor do
+    an option's id and author: pages only get its key and text.
+    """
+    options = [{'id': b['id'], 'text': b['text'], 'player_id': b['player_id']} for b in sorted(bluffs, key=lambda b: b['id'])]
+    options.append({'id': 0, 'text': real_answer, 'player_id': None})
+    random.Random(seed).shuffle(options)
+    for option in options:
+        option['key'] = option_key(game_id, seed, option['id'])
+    return options
+
+
+def build_snapshot(game):
+    """Serialize a game loaded through snapshot_queryset() into plain, cacheable data"""
+    points = {score.user_id: score.points for score in game.leaderboard.all()}
+    players = [
+        {'id': user.id, 'username': user.username, 'avatar': _avatar(user), 'points': points.get(user.id, 0)}
+        for user in game.players.all()
+    ]
+
+    bluffs = [
+        {
+            'id': bluff.id,
+            'player_id': bluff.player_id,
+            'player': bluff.player.username,
+            'avatar': _avatar(bluff.player),
+            'text': bluff.text,
+            'voters': [voter.username for voter in bluff.voters.all()],
+        }
+        for bluff in game.kalakbluff_set.all()
+    ]
+
+    return {
+        'id': game.id,
+        'room_code': game.room_code,
+        'version': game.version,
+        'updated_at': game.updated_at.isoformat(),
+        'admin_id': game.admin_id,
+        'current_game': game.current_game,
+        'is_active': game.is_active,
+        'current_word': game.current_word,
+        'spy_user_id': game.spy_user_id,
+        'is_voting': game.is_voting,
+        'kalak_question': game.kalak_question,
+        'kalak_real_answer': game.kalak_real_answer,
+        'kalak_round': game.kalak_round,
+        'kalak_image_url': game.kalak_image_url,
+        'kalak_phase': game.kalak_phase,
+        'config_overrides': game.config_overrides,
+        'round_config': game.round_config,
+        'players': players,
+        'player_ids': [p['id'] for p in players],
+        'round_player_ids': scoring.done_player_ids(game.id, game.kalak_round, game.kalak_phase),
+        'bluffs': bluffs,
+        'voting_options': (voting_options(game.id, game.kalak_seed, bluffs, game.kalak_real_answer)
+                           if game.kalak_phase == 'VOTING' else []),
+    }
+
+
+def load_snapshot(**lookup):
+    """Build the snapshot of the game matching lookup (room_code=... or pk=...), None if there is none"""
+    game = snapshot_queryset().filter(**lookup).first()
+    return build_snapshot(game) if game is not None else None
+
+
+def leaderboard(snapshot):
+    return sorted(snapshot['players'], key=lambda p: -p['points'])
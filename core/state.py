@@ -0,0 +1,231 @@
+"""
+Shared live state: room snapshots and versions, and the per-round counters
+of core/scoring.py (who is done with the phase, votes, points).
+
+Everything goes through a small Redis-shaped interface, so that the same code
+runs on:
+  - InMemoryBackend, the default: a dict in this process. Enough for a single
+    worker (like the in-process broker), and what the tests use;
+  - RedisBackend: any server speaking the Redis protocol, shared by every
+    worker and node. Needs the `redis` package and ROOM_STATE_REDIS_URL.
+
+Values given to get()/set() are plain data (JSON on Redis). Set members and
+hash fields are strings, hash values are integers.
+Pick the backend with ROOM_STATE_BACKEND.
+"""
+import copy
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class StateBackend:
+    """Interface every state backend implements; every method is atomic"""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def expire(self, key, ttl):
+        raise NotImplementedError
+
+    def sadd(self, key, member):
+        """True if member was not in the set yet"""
+        raise NotImplementedError
+
+    def srem(self, key, member):
+        raise NotImplementedError
+
+    def smembers(self, key):
+        raise NotImplementedError
+
+    def scard(self, key):
+        raise NotImplementedError
+
+    def hset(self, key, field, value):
+        raise NotImplementedError
+
+    def hdel(self, key, field):
+        raise NotImplementedError
+
+    def hincrby(self, key, field, amount=1):
+        """The field's new value"""
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every key (tests, load tests)"""
+        raise NotImplementedError
+
+
+class InMemoryBackend(StateBackend):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+
+    def _live(self, key):
+        # call with the lock held
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    # values are copied in and out, as a real store would: callers may change what they got
+    def get(self, key):
+        with self.lock:
+            return copy.deepcopy(self._live(key))
+
+    def set(self, key, value, ttl=None):
+        value = copy.deepcopy(value)
+        with self.lock:
+            self.data[key] = value
+            if ttl is None:
+                self.expires.pop(key, None)
+            else:
+                self.expires[key] = time.monotonic() + ttl
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+
+    def expire(self, key, ttl):
+        with self.lock:
+            if self._live(key) is not None:
+                self.expires[key] = time.monotonic() + ttl
+
+    def sadd(self, key, member):
+        with self.lock:
+            members = self._live(key)
+            if members is None:
+                members = self.data[key] = set()
+            if member in members:
+                return False
+            members.add(member)
+            return True
+
+    def srem(self, key, member):
+        with self.lock:
+            (self._live(key) or set()).discard(member)
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._live(key) or ())
+
+    def scard(self, key):
+        with self.lock:
+            return len(self._live(key) or ())
+
+    def hset(self, key, field, value):
+        with self.lock:
+            fields = self._live(key)
+            if fields is None:
+                fields = self.data[key] = {}
+            fields[field] = value
+
+    def hdel(self, key, field):
+        with self.lock:
+            (self._live(key) or {}).pop(field, None)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            fields = self._live(key)
+            if fields is None:
+                fields = self.data[key] = {}
+            fields[field] = fields.get(field, 0) + amount
+            return fields[field]
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self._live(key) or {})
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.expires.clear()
+
+
+class RedisBackend(StateBackend):
+    """Keys are prefixed with ROOM_STATE_PREFIX so several sites can share a server"""
+
+    def __init__(self, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(_setting('ROOM_STATE_REDIS_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.prefix = _setting('ROOM_STATE_PREFIX', 'knidla:')
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self._key(key), json.dumps(value), px=None if ttl is None else int(ttl * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self._key(key) for key in keys])
+
+    def expire(self, key, ttl):
+        self.client.pexpire(self._key(key), int(ttl * 1000))
+
+    def sadd(self, key, member):
+        return self.client.sadd(self._key(key), member) == 1
+
+    def srem(self, key, member):
+        self.client.srem(self._key(key), member)
+
+    def smembers(self, key):
+        return {member.decode() for member in self.client.smembers(self._key(key))}
+
+    def scard(self, key):
+        return self.client.scard(self._key(key))
+
+    def hset(self, key, field, value):
+        self.client.hset(self._key(key), field, value)
+
+    def hdel(self, key, field):
+        self.client.hdel(self._key(key), field)
+
+    def hincrby(self, key, field, amount=1):
+        return self.client.hincrby(self._key(key), field, amount)
+
+    def hgetall(self, key):
+        return {field.decode(): int(value) for field, value in self.client.hgetall(self._key(key)).items()}
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = import_string(_setting('ROOM_STATE_BACKEND', 'core.state.InMemoryBackend'))()
+    return _state
@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (CachedReply, Game, GameConfig, KalakBluff, KalakConfig, KalakQuestion, PlayerScore, Profile,
+                     RoundHistory, SpyWord, User)
+from . import (ai, bluffs, checks, config as site_config, llmcache, metrics, models, pool, presence, reaper, scoring,
+               state, views)
+from .broker import get_broker
+from .events import room_events
+from .realtime import room_channel
+from .roomstate import get_snapshot, publish_room, version_key
+from .snapshot import load_snapshot
+from .state import get_state
+
+
+class StubKalakGenerator:
+    """Stands in for Gemini: yields `count` numbered questions per call and records every call"""
+
+    def __init__(self):
+        self.calls = []
+        self.issued = 0
+
+    def __call__(self, theme, count, config):
+        self.calls.append(theme)
+        for _ in range(count):
+            self.issued += 1
+            yield f"{theme} question {self.issued} ?", f"answer {self.issued}", "_"
+
+
+class StubSpyGenerator:
+    """Stands in for Gemini: returns `count` new words per call plus two repeats of earlier ones"""
+
+    def __init__(self):
+        self.calls = 0
+        self.issued = 0
+
+    def __call__(self, category, count, config):
+        self.calls += 1
+        start = self.issued
+        self.issued += count
+        return [f"Mot {i}" for i in range(max(start - 2, 0), start + count)]
+
+
+def make_user(username):
+    # like SignUpView: every user has a profile
+    user = User.objects.create_user(username, password='pw')
+    Profile.objects.create(user=user, avatar_url=f"https://example.com/{username}.png")
+    return user
+
+
+def make_room(admin, *players):
+    game = Game.objects.create(admin=admin)
+    game.players.add(admin, *players)
+    game.recount()
+    for user in (admin,) + players:
+        PlayerScore.objects.create(user=user, game=game)
+    return game
+
+
+def enter_room(client, user, game):
+    client.force_login(user)
+    session = client.session
+    session['room_code'] = game.room_code
+    session.save()
+
+
+@override_settings(POOL_BACKGROUND_REFILL=False, KALAK_POOL_LOW_WATERMARK=2, KALAK_POOL_HIGH_WATERMARK=4)
+class KalakPoolTests(TestCase):
+
+    def setUp(self):
+        self.config = KalakConfig.objects.create(id=1, categories="espace, pirates")
+        self.generator = StubKalakGenerator()
+
+    def test_refill_tops_up_each_theme_to_high_watermark(self):
+        added = pool.refill_kalak_pool(self.generator)
+
+        self.assertEqual(added, 8)
+        self.assertEqual(KalakQuestion.objects.filter(theme="espace").count(), 4)
+        self.assertEqual(KalakQuestion.objects.filter(theme="pirates").count(), 4)
+
+    def test_refill_asks_for_a_whole_theme_in_one_call(self):
+        pool.refill_kalak_pool(self.generator)
+
+        self.assertEqual(self.generator.calls, ["espace", "pirates"])
+
+    def test_refill_skips_themes_above_low_watermark(self):
+        pool.refill_kalak_pool(self.generator)
+        pool.pop_kalak_question(self.config)
+
+        self.assertEqual(pool.refill_kalak_pool(self.generator), 0)
+
+    def test_pop_removes_question_from_pool(self):
+        pool.refill_kalak_pool(self.generator)
+
+        item = pool.pop_kalak_question(self.config)
+
+        self.assertIn(item.theme, ["espace", "pirates"])
+        self.assertIsNotNone(KalakQuestion.objects.get(id=item.id).used_at)
+        self.assertNotIn(item.id, [pool.pop_kalak_question(self.config).id for _ in range(7)])
+
+    def test_start_round_serves_from_pool_without_live_call(self):
+        pool.refill_kalak_pool(self.generator)
+        admin = make_user('admin')
+        game = make_room(admin)
+        enter_room(self.client, admin, game)
+
+        with mock.patch('core.views.generate_kalak_question') as live:
+            self.client.post(reverse('start_kalak'))
+
+        live.assert_not_called()
+        game.refresh_from_db()
+        self.assertIn(" question ", game.kalak_question)
+        self.assertEqual(game.kalak_phase, 'WRITING')
+        self.assertEqual(KalakQuestion.objects.filter(used_at__isnull=True).count(), 7)
+
+    def test_rooms_with_their_own_prompt_get_their_own_pool(self):
+        pool.refill_kalak_pool(self.generator)
+        game = make_room(make_user('admin'))
+        site_config.set_overrides(game, 'KALAK', {'system_prompt': "Autre chose : {theme}", 'categories': "dragons"})
+        game.save()
+        room = site_config.resolve('KALAK', game.config_overrides['KALAK'])
+
+        self.assertIsNone(pool.pop_kalak_question(room))
+
+        pool.refill_kalak_pool(self.generator)
+        self.assertEqual(self.generator.calls[-1], "dragons")
+        item = pool.pop_kalak_question(room)
+        self.assertEqual((item.theme, item.pool_key), ("dragons", room.pool_key()))
+        self.assertNotEqual(room.pool_key(), site_config.kalak_config().pool_key())
+
+    def test_stock_of_a_prompt_nobody_uses_is_dropped(self):
+        pool.refill_kalak_pool(self.generator)
+        self.config.system_prompt = "Nouveau : {theme}"
+        self.config.save()
+
+        self.assertEqual(pool.refill_kalak_pool(self.generator), 8)
+        self.assertEqual(set(KalakQuestion.objects.values_list('pool_key', flat=True)),
+                         {site_config.kalak_config().pool_key()})
+
+    def test_served_questions_do_not_come_back(self):
+        pool.refill_kalak_pool(self.generator)
+        served = [pool.pop_kalak_question(self.config).question for _ in range(6)]
+
+        def repeats(theme, count, config):
+            # the model keeps offering what was already played
+            return [(q.upper(), "a", "_") for q in served]
+
+        self.assertEqual(pool.refill_kalak_pool(repeats), 0)
+
+        # outside the window they may be asked again
+        with self.settings(KALAK_DEDUP_WINDOW=2):
+            self.assertGreater(pool.refill_kalak_pool(repeats), 0)
+            self.assertEqual(KalakQuestion.objects.filter(used_at__isnull=False).count(), 2)
+
+
+@override_settings(POOL_BACKGROUND_REFILL=False, SPY_POOL_LOW_WATERMARK=5,
+                   SPY_POOL_HIGH_WATERMARK=20, SPY_POOL_BATCH_SIZE=10)
+class SpyWordPoolTests(TestCase):
+
+    def setUp(self):
+        self.config = GameConfig.objects.create(id=1, categories="Un animal")
+        self.generator = StubSpyGenerator()
+
+    def test_refill_batches_and_deduplicates(self):
+        added = pool.refill_spy_pool(self.generator)
+
+        self.assertEqual(added, 20)
+        self.assertLessEqual(self.generator.calls, 3)
+        normalized = list(SpyWord.objects.values_list('normalized', flat=True))
+        self.assertEqual(len(normalized), len(set(normalized)))
+
+    def test_used_words_are_not_generated_again(self):
+        SpyWord.objects.create(category="Un animal", word="Mot 0", normalized="mot 0", pool_key=self.config.pool_key())
+        word = pool.pop_spy_word(self.config)
+
+        pool.refill_spy_pool(self.generator)
+
+        self.assertEqual(word, "Mot 0")
+        self.assertEqual(SpyWord.objects.filter(normalized="mot 0").count(), 1)
+
+    def test_parse_spy_words_strips_list_markers(self):
+        from .views import parse_spy_words
+
+        self.assertEqual(parse_spy_words("1. Un Chat.\n- Girafe\n\n3) Ours"), ["Un Chat", "Girafe", "Ours"])
+
+
+class RoomEventsTests(TestCase):
+
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.game = make_room(self.admin)
+
+    def open_stream(self, room_code):
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        return ApplicationCommunicator(room_events, {
+            'type': 'http', 'path': f'/events/{room_code}/', 'headers': [(b'cookie', cookie.encode())],
+        })
+
+    def test_stream_sends_full_state_then_only_changes(self):
+        enter_room(self.client, self.admin, self.game)
+
+        async def scenario():
+            stream = self.open_stream(self.game.room_code)
+            await stream.send_input({'type': 'http.request'})
+            start = await stream.receive_output(1)
+            full = json.loads((await stream.receive_output(1))['body'][6:])
+
+            self.game.kalak_phase = 'VOTING'
+            await sync_to_async(self.game.save)()
+            await sync_to_async(publish_room)(self.game)
+            delta = json.loads((await stream.receive_output(1))['body'][6:])
+
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(1)
+            return start, full, delta
+
+        start, full, delta = async_to_sync(scenario)()
+
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(full['phase'], 'WRITING')
+        self.assertEqual(full['players'][0][1], 'admin')
+        self.assertEqual(set(delta), {'v', 'phase'})
+        self.assertEqual(delta['phase'], 'VOTING')
+
+    def test_stream_refuses_other_rooms(self):
+        enter_room(self.client, self.admin, self.game)
+
+        async def scenario():
+            stream = self.open_stream('ZZZZ')
+            await stream.send_input({'type': 'http.request'})
+            return await stream.receive_output(1)
+
+        self.assertEqual(async_to_sync(scenario)()['status'], 403)
+
+
+class ConditionalStatusTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.admin = make_user('admin')
+        self.game = make_room(self.admin)
+        self.url = reverse('game_data_api', args=[self.game.room_code])
+
+    def test_unchanged_poll_is_304_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_quiet_room_is_polled_without_queries_long_after_its_last_change(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch('core.state.time.monotonic', return_value=time.monotonic() + 600):
+            with self.assertNumQueries(0):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_room_returns_fresh_payload(self):
+        etag = self.client.get(self.url)['ETag']
+        self.game.kalak_phase = 'VOTING'
+        self.game.save()
+        publish_room(self.game)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['phase'], 'VOTING')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_long_poll_times_out_with_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        started = time.monotonic()
+        response = self.client.get(self.url, {'wait': '0.3'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    def test_long_poll_wakes_up_on_publish(self):
+        etag = self.client.get(self.url)['ETag']
+        code, version = self.game.room_code, int(etag.strip('"'))
+
+        def change_room():
+            time.sleep(0.2)
+            # as if another worker had published a change
+            get_state().set(version_key(code), version + 1, 60)
+            get_broker().publish(room_channel(code), {})
+
+        threading.Thread(target=change_room).start()
+        started = time.monotonic()
+        response = self.client.get(self.url, {'wait': '5'}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_status_view_uses_session_room(self):
+        enter_room(self.client, self.admin, self.game)
+
+        response = self.client.get(reverse('game_status'))
+
+        self.game.refresh_from_db()
+        self.assertEqual(response.json()['version'], self.game.version)
+
+
+class RoomSnapshotTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.admin = make_user('admin')
+        self.player = make_user('player')
+        self.game = make_room(self.admin, self.player)
+
+    def test_version_is_bumped_and_never_rewound_by_a_stale_save(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        publish_room(self.game)
+        publish_room(self.game)
+
+        stale.kalak_round = 3
+        stale.save()
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.version, 2)
+        self.assertEqual(self.game.kalak_round, 3)
+
+    def test_snapshot_follows_published_changes(self):
+        publish_room(self.game)
+        self.game.kalak_phase = 'VOTING'
+        self.game.save()
+        publish_room(self.game)
+
+        room = get_snapshot(self.game.room_code)
+
+        self.assertEqual(room['kalak_phase'], 'VOTING')
+        self.assertEqual(room['player_ids'], [self.admin.id, self.player.id])
+
+    def test_lobby_renders_from_snapshot(self):
+        publish_room(self.game)
+        enter_room(self.client, self.player, self.game)
+        self.client.get(reverse('lobby'))
+
+        # the user only: session and room both come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('lobby'))
+
+        self.assertContains(response, 'player')
+
+
+class SnapshotQueryCountTests(TestCase):
+    """The snapshot (and so every status poll that misses the cache) costs the same whatever the room size"""
+
+    def setUp(self):
+        get_state().clear()
+
+    def make_full_room(self, size):
+        users = [make_user(f"p{size}_{i}") for i in range(size)]
+        game = make_room(*users)
+        for user in users[:size // 2]:
+            get_state().sadd(scoring.phase_key(game.pk, game.kalak_round, game.kalak_phase, 'done'), str(user.id))
+        for author in users:
+            bluff = KalakBluff.objects.create(game=game, player=author, text=f"lie by {author.username}")
+            bluff.voters.add(*[u for u in users if u != author][:2])
+        return game
+
+    def test_snapshot_query_count_does_not_grow_with_players(self):
+        small, large = self.make_full_room(2), self.make_full_room(8)
+
+        with self.assertNumQueries(5):
+            load_snapshot(pk=small.pk)
+        with self.assertNumQueries(5):
+            room = load_snapshot(pk=large.pk)
+
+        self.assertEqual(len(room['players']), 8)
+        self.assertEqual(len(room['round_player_ids']), 4)
+        self.assertEqual(len(room['bluffs'][0]['voters']), 2)
+
+    def test_cold_game_data_api_is_constant(self):
+        game = self.make_full_room(8)
+        get_state().clear()
+
+        # version lookup + snapshot
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('game_data_api', args=[game.room_code]))
+
+        self.assertEqual(len(response.json()['leaderboard']), 8)
+
+
+class CurrentGameTests(TestCase):
+
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.player = make_user('player')
+        self.game = make_room(self.admin, self.player)
+
+    def resolve(self, user):
+        request = mock.Mock(user=user, session={'room_code': self.game.room_code})
+        from .views import get_current_game
+        return get_current_game(request), request
+
+    def test_member_is_resolved_with_role_in_one_query(self):
+        with self.assertNumQueries(1):
+            game, _ = self.resolve(self.admin)
+
+        self.assertTrue(game.is_admin)
+        self.assertFalse(game.is_spy)
+
+    def test_kicked_player_loses_the_room(self):
+        self.game.players.remove(self.player)
+
+        game, request = self.resolve(self.player)
+
+        self.assertIsNone(game)
+        self.assertNotIn('room_code', request.session)
+
+
+class ConcurrentScoringTests(TransactionTestCase):
+    """Hundreds of simultaneous submissions against one room"""
+
+    PLAYERS = 150
+
+    def setUp(self):
+        get_state().clear()
+        users = User.objects.bulk_create([User(username=f"p{i}") for i in range(self.PLAYERS)])
+        self.users = list(User.objects.order_by('id'))
+        self.game = Game.objects.create(admin=self.users[0], kalak_phase='VOTING')
+        self.game.players.add(*self.users)
+        self.game.recount()
+        PlayerScore.objects.bulk_create([PlayerScore(game=self.game, user=user) for user in self.users])
+        self.bluff = KalakBluff.objects.create(game=self.game, player=self.users[0], text="lie")
+
+    def storm(self, calls):
+        """Run every call at once, each on its own thread and connection"""
+        barrier = threading.Barrier(len(calls))
+        results = []
+
+        def run(call):
+            try:
+                barrier.wait()
+                results.append(call())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_every_vote_counts_once_and_the_phase_advances_once(self):
+        calls = []
+        for i, user in enumerate(self.users):
+            choice = self.bluff.id if i % 2 else 0
+            # every player double-clicks
+            calls += [lambda u=user, c=choice: scoring.cast_vote(self.game, u, c)] * 2
+
+        results = self.storm(calls)
+
+        self.assertEqual(results.count(scoring.ADVANCED), 1)
+        self.assertEqual(results.count(scoring.ACCEPTED), self.PLAYERS - 1)
+        self.assertEqual(len(results), 2 * self.PLAYERS)
+
+        fooled = self.PLAYERS // 2
+        points = dict(PlayerScore.objects.values_list('user_id', 'points'))
+        self.assertEqual(sum(points.values()), 2 * (self.PLAYERS - fooled) + fooled)
+        self.assertEqual(points[self.users[0].id], 2 + fooled)
+        self.assertEqual(self.bluff.voters.count(), fooled)
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.kalak_phase, 'RESULTS')
+        # the round's counters are on their way out
+        self.assertTrue(all(at - time.monotonic() <= scoring.FLUSHED_ROUND_TTL for at in get_state().expires.values()))
+
+    def test_late_votes_are_turned_away(self):
+        Game.objects.filter(pk=self.game.pk).update(kalak_phase='RESULTS')
+
+        self.assertEqual(scoring.cast_vote(self.game, self.users[1], 0), scoring.WRONG_PHASE)
+        self.assertEqual(PlayerScore.objects.get(user=self.users[1]).points, 0)
+
+    def test_admin_forced_advance_flushes_the_round(self):
+        self.assertEqual(scoring.cast_vote(self.game, self.users[1], 0), scoring.ACCEPTED)
+        enter_room(self.client, self.users[0], self.game)
+
+        with mock.patch('core.views.prefetch_kalak_round') as prefetch:
+            self.client.post(reverse('advance_phase'))
+        prefetch.assert_called_once()
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.kalak_phase, 'RESULTS')
+        self.assertEqual(PlayerScore.objects.get(user=self.users[1]).points, scoring.CORRECT_ANSWER_POINTS)
+        self.assertEqual(RoundHistory.objects.filter(game=self.game).count(), 1)
+
+    def test_points_of_players_who_left_are_dropped(self):
+        # the bluff's author left and joined another room before the last vote
+        self.game.remove_player(self.users[0])
+        PlayerScore.objects.filter(game=self.game, user=self.users[0]).delete()
+        other = Game.objects.create(admin=self.users[0])
+        PlayerScore.objects.create(game=other, user=self.users[0])
+
+        self.assertEqual(scoring.cast_vote(self.game, self.users[1], self.bluff.id), scoring.ACCEPTED)
+        self.assertEqual(scoring.force_advance(self.game), 'RESULTS')
+        self.assertEqual(PlayerScore.objects.get(user=self.users[0]).points, 0)
+
+
+class RoomRosterTests(TestCase):
+    """Phase checks and the spy draw only look at the room's own players"""
+
+    def setUp(self):
+        get_state().clear()
+        self.admin, self.player, self.outsider = make_user('admin'), make_user('player'), make_user('outsider')
+        self.game = make_room(self.admin)
+        # a busy room next door must not hold this one back
+        make_room(self.outsider, *[make_user(f"other{i}") for i in range(3)])
+
+    def test_join_and_kick_keep_the_count(self):
+        enter_room(self.client, self.player, self.game)
+        self.client.post(reverse('join_room'), {'room_code': self.game.room_code})
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.player_count, 2)
+
+        enter_room(self.client, self.admin, self.game)
+        self.client.post(reverse('kick_player', args=[self.player.id]))
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.player_count, 1)
+
+        # and the kicked player can go and play elsewhere
+        elsewhere = make_room(make_user('host'))
+        self.client.force_login(self.player)
+        self.client.post(reverse('join_room'), {'room_code': elsewhere.room_code})
+        self.assertEqual(PlayerScore.objects.get(user=self.player).game, elsewhere)
+
+    def test_kick_only_reaches_the_room(self):
+        enter_room(self.client, self.admin, self.game)
+        version = get_state().get(version_key(self.game.room_code))
+
+        for player_id in (987654, self.outsider.id):
+            response = self.client.post(reverse('kick_player', args=[player_id]))
+            self.assertRedirects(response, reverse('lobby'), fetch_redirect_response=False)
+
+        # the outsider keeps their own room and score, and nobody was told anything
+        self.assertIn(self.outsider, Game.objects.get(admin=self.outsider).players.all())
+        self.assertTrue(PlayerScore.objects.filter(user=self.outsider).exists())
+        self.assertEqual(get_state().get(version_key(self.game.room_code)), version)
+
+    def test_the_room_creator_scores_too(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('create_room'))
+        game = Game.objects.get(admin=self.admin, room_code=self.client.session['room_code'])
+        self.client.force_login(self.player)
+        self.client.post(reverse('join_room'), {'room_code': game.room_code})
+
+        Game.objects.filter(pk=game.pk).update(kalak_phase='VOTING')
+        scoring.cast_vote(game, self.admin, 0)
+        self.assertEqual(scoring.cast_vote(game, self.player, 0), scoring.ADVANCED)
+
+        self.assertEqual(dict(PlayerScore.objects.filter(game=game).values_list('user__username', 'points')),
+                         {'admin': 2, 'player': 2})
+
+    def test_voting_ends_when_the_room_is_done(self):
+        self.game.add_player(self.player)
+        Game.objects.filter(pk=self.game.pk).update(kalak_phase='VOTING')
+
+        self.assertEqual(scoring.cast_vote(self.game, self.admin, 0), scoring.ACCEPTED)
+        self.assertEqual(scoring.cast_vote(self.game, self.player, 0), scoring.ADVANCED)
+
+    def test_leaving_can_complete_the_phase(self):
+        self.game.add_player(self.player)
+        Game.objects.filter(pk=self.game.pk).update(kalak_phase='VOTING')
+        scoring.cast_vote(self.game, self.admin, 0)
+
+        enter_room(self.client, self.player, self.game)
+        self.client.post(reverse('leave_room'))
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.kalak_phase, 'RESULTS')
+
+    @override_settings(POOL_BACKGROUND_REFILL=False)
+    def test_spy_is_one_of_the_room_players(self):
+        self.game.add_player(self.player)
+        enter_room(self.client, self.admin, self.game)
+
+        with mock.patch('core.views.next_spy_word', return_value="Tortue"):
+            for _ in range(5):
+                self.client.post(reverse('start_round'))
+                self.game.refresh_from_db()
+                self.assertIn(self.game.spy_user_id, {self.admin.id, self.player.id})
+
+
+class AIGatewayTests(TestCase):
+
+    def gateway(self, provider, **kwargs):
+        self.now = 0
+        breaker = ai.CircuitBreaker(threshold=2, cooldown=30, clock=lambda: self.now)
+        return ai.AIGateway(provider, breaker=breaker, **kwargs)
+
+    def test_breaker_opens_then_recovers_through_one_probe(self):
+        provider = ai.FakeProvider(error=RuntimeError("503"))
+        gateway = self.gateway(provider)
+
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                gateway.generate("prompt", "model")
+        # open: refused without calling upstream
+        with self.assertRaises(ai.AIUnavailable):
+            gateway.generate("prompt", "model")
+        self.assertEqual(len(provider.prompts), 2)
+
+        self.now = 31
+        provider.error, provider.reply = None, "back"
+        self.assertEqual(gateway.generate("prompt", "model"), "back")
+        self.assertEqual(gateway.stats()['breaker'], 'closed')
+
+    def test_deadline_and_in_flight_cap(self):
+        gateway = self.gateway(ai.FakeProvider("late", latency=0.3), timeout=0.05, max_in_flight=1)
+
+        start = time.perf_counter()
+        with self.assertRaises(ai.AIUnavailable):
+            gateway.generate("prompt", "model")
+        self.assertLess(time.perf_counter() - start, 0.2)
+
+        # the slow call still holds the only slot
+        with self.assertRaises(ai.AIUnavailable):
+            gateway.generate("prompt", "model")
+
+        stats = gateway.stats()
+        self.assertEqual((stats['timed_out'], stats['rejected']), (1, 1))
+
+    def test_spy_word_falls_back_while_upstream_is_down(self):
+        from .views import BACKUP_WORDS, get_ai_word
+
+        gateway = self.gateway(ai.FakeProvider(error=RuntimeError("503")))
+        gateway.breaker.opened_at = 0
+        with mock.patch.object(ai, '_gateway', gateway):
+            self.assertIn(get_ai_word(), BACKUP_WORDS)
+        self.assertEqual(gateway.provider.prompts, [])
+
+
+@override_settings(LLM_CACHE_MAX_ENTRIES=3)
+class ReplyCacheTests(TestCase):
+
+    def setUp(self):
+        self.provider = ai.FakeProvider(reply=lambda prompt: f"reply {len(self.provider.prompts)}")
+        gateway = ai.AIGateway(self.provider)
+        patcher = mock.patch.object(ai, '_gateway', gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        admin = make_user('admin')
+        self.room, self.other_room = make_room(admin), make_room(make_user('other'))
+
+    def generate(self, room, prompt="prompt"):
+        return llmcache.generate(prompt, "model", "animaux", room)
+
+    def test_other_rooms_reuse_a_reply_but_a_room_never_sees_it_twice(self):
+        first = self.generate(self.room)
+        self.assertEqual(self.generate(self.other_room), first)
+        self.assertNotEqual(self.generate(self.room), first)
+
+        self.assertEqual(len(self.provider.prompts), 2)
+        self.assertEqual(CachedReply.objects.get(reply=first).hits, 1)
+
+    def test_stale_reply_is_served_while_a_fresh_one_is_made(self):
+        first = self.generate(self.room)
+        CachedReply.objects.update(created_at=timezone.now() - timedelta(days=30))
+
+        with mock.patch('core.llmcache.refresh_later', side_effect=llmcache.refresh):
+            self.assertEqual(self.generate(self.other_room), first)
+
+        self.assertEqual(CachedReply.objects.count(), 2)
+        self.assertEqual(llmcache.lookup(CachedReply.objects.first().key).reply, "reply 2")
+
+    def test_least_recently_used_replies_are_evicted(self):
+        for prompt in ("a", "b", "c", "d"):
+            self.generate(self.room, prompt)
+
+        self.assertEqual(sorted(CachedReply.objects.values_list('prompt', flat=True)), ["b", "c", "d"])
+
+
+class KalakStreamTests(TestCase):
+
+    REPLY = (
+        "1. Quel animal dort debout ?|Le cheval|_\n"
+        "Question : Combien de cœurs a une pieuvre ?|Réponse : trois\n"
+        "Voici d'autres questions :\n"
+        "2) Quel animal dort debout ?|le cheval\n"
+        "Trop|court\n"
+        "Quelle planète tourne à l'envers ?|Vénus|https://example.com/venus.png"
+    )
+
+    def test_lines_are_validated(self):
+        from .views import parse_kalak_line
+
+        self.assertEqual(parse_kalak_line("1. Quel animal dort debout ?|Le cheval."),
+                         ("Quel animal dort debout ?", "le cheval", "_"))
+        self.assertIsNone(parse_kalak_line("Une question ?|une réponse bien trop longue pour tenir en huit mots max"))
+        self.assertIsNone(parse_kalak_line("a|b|c|d"))
+        self.assertIsNone(parse_kalak_line("Q|"))
+
+    @override_settings(KALAK_POOL_BATCH_SIZE=10)
+    def test_one_streamed_call_fills_the_pool_deduplicated(self):
+        KalakConfig.objects.create(id=1, categories="animaux")
+        provider = ai.FakeProvider(self.REPLY, chunk_size=7)
+
+        with mock.patch.object(ai, '_gateway', ai.AIGateway(provider)):
+            added = pool.refill_kalak_pool(target=3)
+
+        # 4 valid lines, one of them a repeat
+        self.assertEqual(len(provider.prompts), 1)
+        self.assertEqual(added, 3)
+        self.assertEqual(
+            sorted(KalakQuestion.objects.values_list('answer', flat=True)), ["le cheval", "trois", "vénus"]
+        )
+        self.assertEqual(KalakQuestion.objects.get(answer="vénus").image_url, "https://example.com/venus.png")
+
+
+@override_settings(POOL_BACKGROUND_REFILL=False)
+class RoundPrefetchTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.config = KalakConfig.objects.create(id=1, categories="espace")
+        self.admin, self.player = make_user('admin'), make_user('player')
+        self.game = make_room(self.admin, self.player)
+        KalakQuestion.objects.create(theme="espace", question="Quelle planète ?", answer="mars",
+                                     pool_key=self.config.pool_key())
+
+        patcher = mock.patch('core.pool.run_in_background', lambda func, *args: func(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_last_vote_prepares_the_next_round(self):
+        Game.objects.filter(pk=self.game.pk).update(kalak_phase='VOTING')
+        scoring.cast_vote(self.game, self.admin, 0)
+        truth = publish_room(self.game)['voting_options'][0]['key']
+        enter_room(self.client, self.player, self.game)
+
+        self.client.post(reverse('vote_kalak'), {'choice': truth})
+
+        prepared = KalakQuestion.objects.get()
+        self.assertEqual(prepared.reserved_for, self.game)
+        # set aside: nobody else gets it from the pool
+        self.assertIsNone(pool.pop_kalak_question(self.config))
+
+        enter_room(self.client, self.admin, self.game)
+        with mock.patch('core.views.generate_kalak_question') as live:
+            self.client.post(reverse('start_kalak'))
+
+        live.assert_not_called()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.kalak_question, "Quelle planète ?")
+        played = KalakQuestion.objects.get()
+        self.assertEqual((played.reserved_for, played.used_at is not None), (None, True))
+
+    def test_prepared_round_is_dropped_when_the_config_changes(self):
+        pool.prepare_kalak_round(self.game)
+        KalakConfig.objects.filter(id=1).update(categories="pirates")
+        self.config.refresh_from_db()
+
+        with mock.patch('core.views.get_kalak_question', return_value=("Q ?", "a", "_")) as live:
+            self.assertEqual(pool.next_kalak_question(self.config, room=self.game), ("Q ?", "a", "_"))
+
+        live.assert_called_once()
+        self.assertFalse(KalakQuestion.objects.exists())
+
+
+class RoundHistoryTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.alice, self.bob, self.carol = make_user('alice'), make_user('bob'), make_user('carol')
+        self.game = make_room(self.alice, self.bob, self.carol)
+
+    def play_round(self, number):
+        Game.objects.filter(pk=self.game.pk).update(
+            kalak_phase='WRITING', kalak_round=number, kalak_question=f"Question {number} ?", kalak_real_answer="vrai"
+        )
+        KalakBluff.objects.filter(game=self.game).delete()
+        for user in (self.alice, self.bob, self.carol):
+            scoring.submit_bluff(self.game, user, f"mensonge de {user.username}")
+        alice_bluff = KalakBluff.objects.get(player=self.alice, game=self.game)
+
+        # bob and carol fall for alice's bluff, alice finds the truth
+        scoring.cast_vote(self.game, self.bob, alice_bluff.id)
+        scoring.cast_vote(self.game, self.carol, alice_bluff.id)
+        scoring.cast_vote(self.game, self.alice, 0)
+
+    def test_reaching_results_archives_the_round(self):
+        self.play_round(1)
+
+        row = RoundHistory.objects.get()
+        self.assertEqual((row.room_code, row.round_number, row.answer), (self.game.room_code, 1, "vrai"))
+        self.assertEqual(row.data['points'], {str(self.alice.id): 4})
+        self.assertEqual(row.data['votes'][str(self.alice.id)], 0)
+
+        # the archive outlives the room
+        self.game.delete()
+        self.assertTrue(RoundHistory.objects.filter(room_code=row.room_code).exists())
+
+    def test_voter_who_left_without_a_bluff(self):
+        Game.objects.filter(pk=self.game.pk).update(kalak_phase='VOTING', kalak_round=1)
+        # joined during the vote, found the truth, left before the results
+        dave = make_user('dave')
+        self.game.add_player(dave)
+        PlayerScore.objects.create(game=self.game, user=dave)
+        scoring.cast_vote(self.game, dave, 0)
+        self.game.remove_player(dave)
+        PlayerScore.objects.filter(user=dave).delete()
+        for user in (self.alice, self.bob, self.carol):
+            scoring.cast_vote(self.game, user, 0)
+
+        row = RoundHistory.objects.get()
+        self.assertEqual(row.data['players'][str(dave.id)], 'dave')
+        self.assertNotIn(str(dave.id), row.data['points'])
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('game_history', args=[self.game.room_code]))
+        self.assertIn({'username': 'dave', 'points': 0, 'fooled': 0, 'found': 1}, response.context['standings'])
+
+    def test_summary_is_one_read(self):
+        for number in (1, 2):
+            self.play_round(number)
+        self.client.force_login(self.bob)
+        self.client.get(reverse('home'))
+
+        # the user, then the whole game
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('game_history', args=[self.game.room_code]))
+
+        self.assertEqual(response.context['standings'][0], {'username': 'alice', 'points': 8, 'fooled': 4, 'found': 2})
+        self.assertContains(response, "Question 2 ?")
+
+        response = self.client.get(reverse('round_replay', args=[self.game.room_code, 1]))
+        self.assertEqual(response.context['bluffs'][0]['voters'], ['bob', 'carol'])
+
+
+class IdleRoomReaperTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.alice, self.bob = make_user('alice'), make_user('bob')
+        self.idle = make_room(self.alice, self.bob)
+        KalakBluff.objects.create(game=self.idle, player=self.bob, text="mensonge").voters.add(self.alice)
+        RoundHistory.objects.create(room_code=self.idle.room_code, game=self.idle, round_number=1, data={})
+        self.busy = make_room(make_user('carol'))
+        publish_room(self.idle)
+        Game.objects.filter(pk=self.idle.pk).update(updated_at=timezone.now() - timedelta(hours=7))
+
+    def test_only_idle_rooms_go_with_their_rows(self):
+        result = reaper.reap_idle_rooms(ttl=6 * 3600)
+
+        self.assertEqual(result['rooms'], 1)
+        self.assertEqual(result['rows']['core.Game'], 1)
+        self.assertEqual(result['rows']['core.KalakBluff_voters'], 1)
+        self.assertIsNotNone(result['bytes'])
+        self.assertEqual(list(Game.objects.all()), [self.busy])
+        self.assertFalse(PlayerScore.objects.filter(user=self.alice).exists())
+        self.assertIsNone(get_state().get(version_key(self.idle.room_code)))
+        # the archive is kept
+        self.assertIsNone(RoundHistory.objects.get().game)
+
+    def test_chunks_and_activity(self):
+        more = [make_room(make_user(f"p{i}")) for i in range(3)]
+        Game.objects.filter(pk__in=[g.pk for g in more]).update(updated_at=timezone.now() - timedelta(hours=7))
+        # a published change counts as activity
+        publish_room(more[0])
+
+        self.assertEqual(reaper.reap_idle_rooms(ttl=6 * 3600, chunk_size=1)['rooms'], 3)
+        self.assertEqual(set(Game.objects.all()), {self.busy, more[0]})
+
+
+class RoomCodeTests(TestCase):
+
+    def test_codes_grow_with_occupancy(self):
+        self.assertEqual(models.room_code_length(0), 4)
+        self.assertEqual(models.room_code_length(16_000), 4)
+        self.assertEqual(models.room_code_length(17_000), 5)
+        self.assertEqual(models.room_code_length(10 ** 9), models.ROOM_CODE_MAX_LENGTH)
+        self.assertEqual(len(models.generate_room_code(17_000)), 5)
+
+    def test_taken_code_is_drawn_again(self):
+        taken = make_room(make_user('alice'))
+        with mock.patch('core.models.generate_room_code', side_effect=[taken.room_code, 'ZZZZ']):
+            game = Game.create_room(make_user('bob'))
+        self.assertEqual(game.room_code, 'ZZZZ')
+
+    @override_settings(ROOM_CODE_ATTEMPTS=2)
+    def test_gives_up_after_a_few_draws(self):
+        taken = make_room(make_user('alice'))
+        with mock.patch('core.models.generate_room_code', return_value=taken.room_code):
+            with self.assertRaises(IntegrityError):
+                Game.create_room(make_user('bob'))
+
+
+class StateBackendTests(TestCase):
+    """The contract scoring and roomstate rely on, for every backend"""
+
+    def fakeredis(self):
+        try:
+            import fakeredis
+        except ImportError:
+            self.skipTest("fakeredis is not installed (pip install -r requirements-test.txt)")
+        return fakeredis
+
+    def test_in_memory_contract(self):
+        self.check_contract(state.InMemoryBackend())
+
+    def test_redis_contract(self):
+        self.check_contract(state.RedisBackend(self.fakeredis().FakeRedis()))
+
+    def test_redis_broker_reaches_other_processes(self):
+        from .broker import RedisBroker
+        fakeredis = self.fakeredis()
+        server = fakeredis.FakeServer()
+        # one broker per "process", sharing only the Redis server
+        listener = RedisBroker(fakeredis.FakeRedis(server=server))
+        publisher = RedisBroker(fakeredis.FakeRedis(server=server))
+
+        async def scenario():
+            subscription = listener.subscribe('room:ABCD')
+            try:
+                # the listener thread subscribes in the background: publish until it hears
+                for _ in range(50):
+                    publisher.publish('room:ABCD', {'version': 3})
+                    try:
+                        return await asyncio.wait_for(subscription.get(), 0.1)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                subscription.close()
+
+        self.assertEqual(async_to_sync(scenario)(), {'version': 3})
+
+    def check_contract(self, backend):
+            backend.set('snapshot', {'players': [1, 2], 'phase': 'VOTING'})
+            self.assertEqual(backend.get('snapshot'), {'players': [1, 2], 'phase': 'VOTING'})
+
+            self.assertTrue(backend.sadd('done', '7'))
+            self.assertFalse(backend.sadd('done', '7'))
+            backend.sadd('done', '8')
+            backend.srem('done', '8')
+            self.assertEqual((backend.smembers('done'), backend.scard('done')), ({'7'}, 1))
+
+            backend.hset('votes', '7', 12)
+            self.assertEqual(backend.hincrby('points', '7', 2), 2)
+            self.assertEqual(backend.hincrby('points', '7', 1), 3)
+            self.assertEqual((backend.hgetall('votes'), backend.hgetall('points')), ({'7': 12}, {'7': 3}))
+
+            backend.set('version', 4, ttl=0.05)
+            time.sleep(0.1)
+            self.assertIsNone(backend.get('version'))
+
+            backend.delete('snapshot', 'done')
+            self.assertIsNone(backend.get('snapshot'))
+            self.assertEqual(backend.scard('done'), 0)
+            backend.clear()
+            self.assertEqual(backend.hgetall('points'), {})
+
+
+class PresenceTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        self.admin, self.player = make_user('admin'), make_user('player')
+        self.game = make_room(self.admin, self.player)
+        self.code = self.game.room_code
+
+    def test_heartbeats_expire(self):
+        presence.touch(self.code, self.admin.id)
+        with mock.patch('core.presence.time.time', return_value=time.time() + 30):
+            presence.touch(self.code, self.player.id)
+            self.assertEqual(presence.online_ids(self.code), [self.admin.id, self.player.id])
+        with mock.patch('core.presence.time.time', return_value=time.time() + 60):
+            self.assertEqual(presence.online_ids(self.code), [self.player.id])
+
+        presence.leave(self.code, self.player.id)
+        self.assertEqual(presence.online_ids(self.code), [])
+
+    def test_status_poll_is_a_heartbeat_and_ready_lasts_until_the_round(self):
+        enter_room(self.client, self.player, self.game)
+        self.client.get(reverse('game_status'))
+        self.assertEqual(presence.online_ids(self.code), [self.player.id])
+
+        # no database write, however often it is toggled
+        self.client.get(reverse('lobby'))
+        with self.assertNumQueries(1):
+            self.client.post(reverse('toggle_ready'))
+        self.assertEqual(presence.ready_ids(self.code), [self.player.id])
+        self.assertContains(self.client.get(reverse('lobby')), "Ready!")
+
+        enter_room(self.client, self.admin, self.game)
+        with mock.patch('core.views.next_spy_word', return_value="Tortue"):
+            self.client.post(reverse('start_round'))
+        self.assertEqual(presence.ready_ids(self.code), [])
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        metrics.reset()
+        self.admin = make_user('admin')
+        self.game = make_room(self.admin)
+
+    def test_views_are_timed_with_their_queries(self):
+        enter_room(self.client, self.admin, self.game)
+        for _ in range(3):
+            self.client.get(reverse('lobby'))
+
+        lobby = metrics.report()['views']['lobby']
+        self.assertEqual(lobby['requests'], 3)
+        self.assertEqual(lobby['ms']['samples'], 3)
+        self.assertGreater(lobby['queries']['mean'], 0)
+        self.assertIsNotNone(lobby['db_ms']['mean'])
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_only_counted(self):
+        enter_room(self.client, self.admin, self.game)
+        self.client.get(reverse('lobby'))
+
+        lobby = metrics.report()['views']['lobby']
+        self.assertEqual(lobby['requests'], 1)
+        self.assertEqual(lobby['ms']['samples'], 0)
+
+    def test_sections_and_export(self):
+        with mock.patch('core.views.llmcache.generate', return_value="Tortue"):
+            views.get_ai_word()
+        self.assertEqual(metrics.report()['sections']['get_ai_word']['samples'], 1)
+
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        auth = {'HTTP_AUTHORIZATION': 'Bearer secret'}
+        data = self.client.get(reverse('metrics'), **auth).json()
+        self.assertIn('get_ai_word', data['sections'])
+
+        text = self.client.get(reverse('metrics') + '?format=prometheus', **auth).content.decode()
+        self.assertIn('knidla_section_seconds_count{section="get_ai_word"} 1', text)
+        self.assertIn('knidla_requests_total{view="metrics"} 2', text)
+
+
+class ConfigCacheTests(TestCase):
+
+    def setUp(self):
+        GameConfig.objects.create(id=1)
+        KalakConfig.objects.create(id=1)
+        get_state().clear()
+        site_config.invalidate()
+
+    def test_reads_are_free_once_warm(self):
+        site_config.kalak_config()
+        site_config.game_config()
+        with self.assertNumQueries(0):
+            config = site_config.kalak_config()
+            self.assertEqual(config.max_rounds, 20)
+            self.assertEqual(config.render_prompt("l'espace"), config.row.system_prompt.replace("{theme}", "l'espace"))
+            self.assertEqual(config.fingerprint(), config.row.fingerprint())
+
+        # then one query per check interval, for both configs
+        with mock.patch('core.config.time.monotonic', return_value=time.monotonic() + 2):
+            with self.assertNumQueries(1):
+                site_config.kalak_config()
+                site_config.game_config()
+
+    def test_a_save_shows_up_here_at_once_and_elsewhere_after_the_check_interval(self):
+        self.assertEqual(site_config.game_config().get_category_list()[0], "Un objet du quotidien")
+        # another worker saved: nothing reaches this process but the row itself
+        GameConfig.objects.filter(id=1).update(categories="Un fruit", updated_at=timezone.now())
+
+        self.assertEqual(site_config.game_config().get_category_list()[0], "Un objet du quotidien")
+        later = time.monotonic() + 2
+        with mock.patch('core.config.time.monotonic', return_value=later):
+            self.assertEqual(site_config.game_config().get_category_list(), ["Un fruit"])
+
+            row = GameConfig.objects.get(id=1)
+            row.categories = "Un pays"
+            row.save()
+            self.assertEqual(site_config.game_config().get_category_list(), ["Un pays"])
+
+
+
+class RoomConfigTests(TestCase):
+
+    def setUp(self):
+        KalakConfig.objects.create(id=1)
+        get_state().clear()
+        site_config.invalidate()
+        self.admin = make_user('admin')
+        self.game = make_room(self.admin)
+
+    def test_overrides_keep_only_what_differs_and_inherit_the_rest(self):
+        site_config.set_overrides(self.game, 'KALAK', {'max_rounds': '3', 'model': 'gemini-2.0-flash'})
+        self.assertEqual(self.game.config_overrides, {'KALAK': {'max_rounds': 3}})
+
+        config = site_config.resolve('KALAK', self.game.config_overrides['KALAK'])
+        self.assertEqual(config.max_rounds, 3)
+        self.assertEqual(config.get_categories_list(), site_config.kalak_config().get_categories_list())
+        self.assertEqual(site_config.kalak_config().max_rounds, 20)
+        self.assertIs(site_config.resolve('KALAK', {}), site_config.kalak_config())
+
+    def test_a_round_keeps_the_settings_it_started_with(self):
+        enter_room(self.client, self.admin, self.game)
+        self.client.post(reverse('room_config'), {'KALAK-max_rounds': '3'})
+        self.assertContains(self.client.get(reverse('room_config')), "this room", count=1)
+        with mock.patch('core.views.next_kalak_question', return_value=("Q ?", "a", "_")):
+            self.client.post(reverse('start_kalak'))
+
+        KalakConfig.objects.filter(id=1).update(max_rounds=5, updated_at=timezone.now())
+        site_config.invalidate()
+
+        room = get_snapshot(self.game.room_code)
+        site_config.room_config(room, 'KALAK')
+        with self.assertNumQueries(0):
+            self.assertEqual(site_config.room_config(room, 'KALAK').max_rounds, 3)
+        self.assertEqual(self.client.get(reverse('play')).context['max_rounds'], 3)
+
+        # back to the global value from the next round on
+        self.client.post(reverse('room_config'), {'KALAK-max_rounds': ''})
+        with mock.patch('core.views.next_kalak_question', return_value=("Q ?", "a", "_")):
+            self.client.post(reverse('start_kalak'))
+        self.assertEqual(site_config.room_config(get_snapshot(self.game.room_code), 'KALAK').max_rounds, 5)
+
+
+class KalakFragmentTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        caches['template_fragments'].clear()
+        KalakConfig.objects.create(id=1)
+        site_config.invalidate()
+        self.admin, self.player = make_user('admin'), make_user('player')
+        self.game = make_room(self.admin, self.player)
+        self.game.current_game, self.game.is_active = 'KALAK', True
+        self.game.kalak_phase, self.game.kalak_round = 'VOTING', 1
+        self.game.kalak_question, self.game.kalak_real_answer = "Quelle planète ?", "mars"
+        self.game.save()
+        self.bluff = KalakBluff.objects.create(game=self.game, player=self.player, text="vénus")
+        publish_room(self.game)
+
+    def test_voting_part_without_the_answer_leaking(self):
+        enter_room(self.client, self.player, self.game)
+        url = reverse('kalak_fragment', args=['voting'])
+
+        data = self.client.get(url + '?format=json').json()
+        self.assertEqual(sorted((o['text'], o['mine']) for o in data['options']), [("mars", False), ("vénus", True)])
+        self.assertEqual(self.client.get(reverse('kalak_fragment', args=['results'])).status_code, 409)
+        # nothing tells the truth from a lie but its text: no ids, no authors
+        keys = [o['key'] for o in data['options']]
+        self.assertEqual([len(key) for key in keys], [16, 16])
+        self.assertFalse({'id', 'player_id'} & set(data['options'][0]))
+
+        response = self.client.get(url)
+        self.assertContains(response, 'name="choice"', count=2)
+        self.assertNotContains(response, 'data-author')
+        self.assertNotContains(response, 'value="0"')
+        self.assertNotContains(response, f'value="{self.bluff.id}"')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertContains(self.client.get(reverse('play')), 'class="vote-options"')
+
+    def test_shared_parts_are_rendered_once_per_version(self):
+        room = get_snapshot(self.game.room_code)
+        key = make_template_fragment_key('kalak_options', [self.game.id, room['version']])
+
+        enter_room(self.client, self.player, self.game)
+        mine = self.client.get(reverse('kalak_fragment', args=['card'])).content.decode()
+        self.assertIsNotNone(caches['template_fragments'].get(key))
+
+        enter_room(self.client, self.admin, self.game)
+        theirs = self.client.get(reverse('kalak_fragment', args=['card'])).content.decode()
+        self.assertIn(caches['template_fragments'].get(key), theirs)
+        self.assertIn(caches['template_fragments'].get(key), mine)
+        # each player still gets their own form token and their own lie greyed out
+        lie = next(o['key'] for o in room['voting_options'] if o['id'] == self.bluff.id)
+        self.assertIn(f'[value="{lie}"]', mine)
+        self.assertNotIn("Your Lie", theirs)
+
+    def test_votes_go_by_option_key(self):
+        room = get_snapshot(self.game.room_code)
+        lie = next(o['key'] for o in room['voting_options'] if o['id'] == self.bluff.id)
+        enter_room(self.client, self.admin, self.game)
+
+        self.client.post(reverse('vote_kalak'), {'choice': str(self.bluff.id)})
+        self.client.post(reverse('vote_kalak'), {'choice': lie})
+
+        self.assertEqual(get_state().hgetall(scoring.round_key(self.game.id, 1, 'votes')), {str(self.admin.id): self.bluff.id})
+
+    def test_options_keep_one_order_for_every_player_and_reload(self):
+        for i in range(5):
+            KalakBluff.objects.create(game=self.game, player=self.admin, text=f"bluff {i}")
+        self.game.kalak_seed = 1234
+        self.game.save()
+        publish_room(self.game)
+        url = reverse('kalak_fragment', args=['voting']) + '?format=json'
+
+        enter_room(self.client, self.player, self.game)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            order = [o['key'] for o in self.client.get(url).json()['options']]
+        # only the session and the user: the options come with the snapshot
+        self.assertFalse([q for q in queries if 'core_' in q['sql']])
+        enter_room(self.client, self.admin, self.game)
+        self.assertEqual([o['key'] for o in self.client.get(url).json()['options']], order)
+
+        self.game.kalak_seed = 4321
+        self.game.save()
+        publish_room(self.game)
+        self.assertNotEqual([o['key'] for o in self.client.get(url).json()['options']], order)
+
+
+class BluffCheckTests(TestCase):
+
+    def setUp(self):
+        get_state().clear()
+        bluffs.invalidate()
+        self.admin, self.player, self.other = make_user('admin'), make_user('player'), make_user('other')
+        self.game = make_room(self.admin, self.player, self.other)
+        self.game.current_game, self.game.is_active = 'KALAK', True
+        self.game.kalak_phase, self.game.kalak_round = 'WRITING', 1
+        self.game.kalak_question, self.game.kalak_real_answer = "De quelle couleur ?", "bleu"
+        self.game.save()
+        publish_room(self.game)
+
+    def test_similarity(self):
+        self.assertEqual(bluffs.normalize("L'Éléphant !"), "elephant")
+        self.assertEqual(bluffs.similarity("L'Éléphant !", "elephant"), 1)
+        self.assertEqual(bluffs.check("bleue", "bleu"), bluffs.TOO_CLOSE)
+        self.assertEqual(bluffs.check("chien", "chat"), bluffs.OK)
+        self.assertEqual(bluffs.check("Un éléphant rose", "bleu", ["l'elephant rose"]), bluffs.DUPLICATE)
+
+    def test_claim_once_per_normalized_text(self):
+        self.assertTrue(bluffs.claim(self.game.pk, 1, "Le Vert"))
+        self.assertFalse(bluffs.claim(self.game.pk, 1, "vert !"))
+        bluffs.release(self.game.pk, 1, "vert")
+        self.assertTrue(bluffs.claim(self.game.pk, 1, "vert"))
+
+    def test_submit_refuses_the_answer_and_other_bluffs(self):
+        url = reverse('submit_bluff')
+        enter_room(self.client, self.player, self.game)
+        self.client.post(url, {'bluff_text': "Bleue"})
+        self.client.post(url, {'bluff_text': "Le rouge vif"})
+        self.assertEqual(list(KalakBluff.objects.values_list('text', flat=True)), ["le rouge vif"])
+
+        enter_room(self.client, self.other, self.game)
+        response = self.client.post(url, {'bluff_text': "rouge vif !"}, follow=True)
+        self.assertContains(response, "Someone already wrote that one!")
+        self.client.post(url, {'bluff_text': "vert"})
+        self.assertEqual(KalakBluff.objects.filter(player=self.other).get().text, "vert")
+
+        # the index followed the room through the new bluffs
+        room = get_snapshot(self.game.room_code)
+        self.assertEqual(bluffs.for_room(room).check("VERT"), bluffs.DUPLICATE)
+        self.assertEqual(len(bluffs.for_room(room).bluffs.entries), 2)
+
+
+    def test_rejected_bluff_publishes_nothing(self):
+        url = reverse('submit_bluff')
+        enter_room(self.client, self.player, self.game)
+        self.client.post(url, {'bluff_text': "vert"})
+        version = get_state().get(version_key(self.game.room_code))
+
+        with mock.patch('core.views.publish_room') as publish:
+            response = self.client.post(url, {'bluff_text': "jaune"}, follow=True)
+            self.assertContains(response, "You already sent your bluff!")
+            Game.objects.filter(pk=self.game.pk).update(kalak_phase='VOTING')
+            enter_room(self.client, self.other, self.game)
+            self.client.post(url, {'bluff_text': "rose"})
+        publish.assert_not_called()
+        self.assertEqual(get_state().get(version_key(self.game.room_code)), version)
+        # and neither text stays claimed
+        self.assertTrue(bluffs.claim(self.game.pk, 1, "jaune"))
+        self.assertTrue(bluffs.claim(self.game.pk, 1, "rose"))
+
+class SharedStateCheckTests(TestCase):
+    """Per-process state with several workers is refused"""
+
+    def errors(self):
+        return [error.id for error in checks.shared_state()]
+
+    def test_single_worker_is_fine(self):
+        with override_settings(WEB_CONCURRENCY=1):
+            self.assertEqual(self.errors(), [])
+
+    def test_several_workers_need_shared_state(self):
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual(self.errors(), ['core.E001', 'core.E001'])
+        with override_settings(WEB_CONCURRENCY=4, ROOM_STATE_BACKEND='core.state.RedisBackend',
+                               ROOM_BROKER='core.broker.RedisBroker'):
+            self.assertEqual(self.errors(), [])
+
+    def test_reads_gunicorn_workers_flag(self):
+        with override_settings(WEB_CONCURRENCY=1), \
+                mock.patch('sys.argv', ['/venv/bin/gunicorn', 'knidlaspy.asgi:application', '-w', '3']):
+            self.assertEqual(checks.worker_count(), 3)
+            with self.assertRaises(ImproperlyConfigured):
+                apps.get_app_config('core').ready()
+        with override_settings(WEB_CONCURRENCY=1), mock.patch('sys.argv', ['/venv/bin/gunicorn']), \
+                mock.patch.dict('os.environ', {'GUNICORN_CMD_ARGS': '--workers=2'}):
+            self.assertEqual(checks.worker_count(), 2)
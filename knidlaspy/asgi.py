@@ -2,6 +2,8 @@
 ASGI config for knidlaspy project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests under /events/ are answered by the live room stream in core.events,
+everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knidlaspy.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# needs the app registry loaded by get_asgi_application()
+from core.events import EVENTS_PREFIX, room_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith(EVENTS_PREFIX):
+        return await room_events(scope, receive, send)
+    return await django_application(scope, receive, send)
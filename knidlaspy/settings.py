@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',  # first, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,6 +101,10 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # wait for the write lock under concurrent requests instead of failing
+            'OPTIONS': {'timeout': 20},
+            # on disk rather than in memory, so threaded tests get SQLite's real locking
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
@@ -129,5 +134,111 @@ if ON_RENDER:
     # Enable WhiteNoise compression
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# --- CONTENT POOLS ---
+# Rounds pop pre-generated questions and words; a background thread refills each theme
+# back up to the high watermark once it drops under the low one.
+# Warm them up front with: python manage.py warm_pools
+POOL_BACKGROUND_REFILL = True
+POOL_REFILL_INTERVAL = 60  # seconds between unprompted refills
+KALAK_POOL_LOW_WATERMARK = 3
+KALAK_POOL_HIGH_WATERMARK = 10
+KALAK_POOL_BATCH_SIZE = 10  # questions asked for in a single (streamed) Gemini call
+KALAK_DEDUP_WINDOW = 200  # a question is not served again within this many rounds
+KALAK_PREFETCH_NEXT_ROUND = True  # prepare each room's next question while it shows RESULTS
+SPY_POOL_LOW_WATERMARK = 5
+SPY_POOL_HIGH_WATERMARK = 30
+SPY_POOL_BATCH_SIZE = 15  # words asked for in a single Gemini call
+SPY_DEDUP_WINDOW = 200  # a word is not served again within this many rounds
+
+# --- AI PROVIDER ---
+# Every Gemini call goes through core/ai.py: a hard deadline per call, a cap on calls in
+# flight, and a circuit breaker that serves fallbacks while upstream keeps failing.
+AI_PROVIDER = 'core.ai.GeminiProvider'
+AI_TIMEOUT = 10  # seconds a request waits for an answer
+AI_MAX_IN_FLIGHT = 4
+AI_BREAKER_THRESHOLD = 5  # failures in a row that open the circuit
+AI_BREAKER_COOLDOWN = 30  # seconds before a probe call is let through
+
+# --- LLM REPLY CACHE ---
+# Live calls (made when a pool is dry) first look for a reply already generated for the
+# same model, category and prompt. See core/llmcache.py and `manage.py llm_cache`.
+LLM_CACHE_ENABLED = True
+LLM_CACHE_TTL = 7 * 24 * 3600  # older replies are still served, but replaced in the background
+LLM_CACHE_MAX_HITS = 50  # a reply is retired after this many serves (never twice to one room)
+LLM_CACHE_MAX_ENTRIES = 5000  # least recently used replies are evicted beyond this
+
+# --- CACHE & LIVE ROOM STATE ---
+# Sessions are cached here. Local memory is per worker: swap in a shared backend
+# (Redis, Memcached) when running several workers or nodes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'knidlaspy',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # {% cache %} blocks of the Kalak page, keyed by room version: nothing to invalidate
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'knidlaspy-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+ROOM_FRAGMENT_TTL = 60
+
+# Room snapshots and versions, and each round's counters (who is done, votes, points)
+# live in a state backend, see core/state.py. The in-memory one is per process, and so
+# is the default broker: it only works with a single worker. With several workers or
+# nodes, use RedisBackend together with ROOM_BROKER = 'core.broker.RedisBroker' (both
+# need the `redis` package). gunicorn starts WEB_CONCURRENCY workers (or -w N); with
+# more than one and per-process state, `manage.py check` fails and gunicorn refuses
+# to start (core/checks.py).
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+ROOM_STATE_BACKEND = 'core.state.InMemoryBackend'
+ROOM_STATE_REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+ROOM_STATE_PREFIX = 'knidla:'
+PRESENCE_TIMEOUT = 45  # seconds without a heartbeat (event stream or status poll) before a player shows offline
+CONFIG_CHECK_INTERVAL = 1  # seconds a worker trusts its cached GameConfig/KalakConfig before checking for edits
+CONFIG_RESOLVED_CACHE_SIZE = 1000  # distinct per-room setting combinations kept resolved per worker
+
+# Status polls answer 304 from the stored room version when nothing changed. It is kept
+# as long as the snapshot; with several workers each on their own in-memory state, set
+# ROOM_VERSION_TTL to a few seconds so they notice each other's changes within that delay.
+ROOM_VERSION_TTL = None
+ROOM_SNAPSHOT_TTL = 3600  # idle rooms drop out of the state after an hour
+LONG_POLL_MAX_WAIT = 25  # upper bound for ?wait=N on the status endpoints
+
+# --- ROOM CODES ---
+# Random codes (A-Z, 0-9) that get longer as rooms fill the keyspace, so a new room
+# rarely draws a taken code; see generate_room_code().
+ROOM_CODE_MIN_LENGTH = 4
+ROOM_CODE_MAX_OCCUPANCY = 0.01  # 4 characters up to ~16k live rooms, 5 up to ~600k, then 6
+ROOM_CODE_ATTEMPTS = 5  # draws before giving up on a create
+
+# --- IDLE ROOMS ---
+# Rooms with no change for ROOM_IDLE_TTL seconds are deleted by `manage.py reap_rooms`,
+# or by a background thread every ROOM_REAP_INTERVAL seconds when that is set.
+ROOM_IDLE_TTL = 6 * 3600
+ROOM_REAP_CHUNK_SIZE = 200  # rooms deleted per transaction
+ROOM_REAP_INTERVAL = None
+
+# --- BLUFFS ---
+# A bluff is refused when this similar (0-1, trigram Dice once normalized, see core/bluffs.py)
+# to the real answer, or to another bluff of the round.
+BLUFF_ANSWER_SIMILARITY = 0.65
+BLUFF_DUPLICATE_SIMILARITY = 0.8
+BLUFF_INDEX_CACHE_SIZE = 500  # rooms whose round index a process keeps
+
+# --- METRICS ---
+# Per-view wall time, query count and DB time, see core/metrics.py. Served at /api/metrics/
+# (JSON, or ?format=prometheus) to staff, or to `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.2))  # share of the requests that are timed
+METRICS_WINDOW = 300  # seconds covered by the JSON report
+METRICS_SLICE = 30
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Sessions are read on every poll: serve them from the cache, write through to the DB
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
@@ -28,14 +28,20 @@ urlpatterns = [
     path('kalak/vote/', views.VoteKalakView.as_view(), name='vote_kalak'),
     path('kalak/advance/', views.AdvancePhaseView.as_view(), name='advance_phase'),
     path('kalak/config/', views.KalakConfigView.as_view(), name='kalak_config'),
+    path('kalak/part/<str:part>/', views.KalakFragmentView.as_view(), name='kalak_fragment'),
+    path('history/<str:room_code>/', views.GameHistoryView.as_view(), name='game_history'),
+    path('history/<str:room_code>/<int:round_number>/', views.RoundReplayView.as_view(), name='round_replay'),
 
     # --- LOBBY & ROOMS ---
     path('create-room/', views.CreateRoomView.as_view(), name='create_room'),
     path('join-room/', views.JoinRoomView.as_view(), name='join_room'),
     path('lobby/', views.LobbyView.as_view(), name='lobby'),
+    path('ready/', views.ToggleReadyView.as_view(), name='toggle_ready'),
+    path('room-settings/', views.RoomConfigView.as_view(), name='room_config'),
     path('kick/<int:player_id>/', views.KickPlayerView.as_view(), name='kick_player'),
     path('leave/', views.LeaveRoomView.as_view(), name='leave_room'),
 
     path('api/game-status/<str:room_code>/', views.game_data_api, name='game_data_api'),
+    path('api/metrics/', views.MetricsView.as_view(), name='metrics'),
 
 ]
\ No newline at end of file